@@ -1,100 +1,193 @@
 # Draw in the air when the index finger is raised.
 # Erase on the canvas when both the index and middle fingers are raised.
+# Strokes are also recorded as vectors (see strokes.py) for undo/redo and saving.
 
 import cv2
 import numpy as np
-import mediapipe as mp
 import datetime
 import os
+import threading
+import HandTrackingModule as htm
+from strokes import DRAW, ERASE, DrawingWriter, StrokeModel
+from camera_feature import CameraFeature
+
+class AirDrawingCanvas(CameraFeature):
+    name = "drawing"
+    mirrored = True
+    # Fingertip smoothing in frame pixels. Not extrapolated: strokes are
+    # permanent, an overshoot would stay on the canvas.
+    smoothing = {"filter": "one_euro", "min_cutoff": 2.0, "beta": 0.01}
+    writer = DrawingWriter()  # one background saver for every session
 
-class AirDrawingCanvas:
     def __init__(self):
-        self.cap = None
+        super().__init__()
         self.canvas = None
-        self.wCam, self.hCam = 640, 480
+        self.alpha = None      # 255 where the canvas has ink, kept in step with the canvas
+        self.ink_rect = None   # x0, y0, x1, y1 around everything drawn so far
         self.prev_x, self.prev_y = 0, 0
-        self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands(max_num_hands=1)
-        self.draw_util = mp.solutions.drawing_utils
-        self.streaming = False  # control flag
-
-    def start_camera(self):
-        if not self.cap or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(0)
-        self.streaming = True
-
-    def stop_camera(self):
-        self.streaming = False
-        if self.cap:
-              self.cap.release()
-              self.cap = None
+        self.strokes = StrokeModel()
+        self.canvas_lock = threading.Lock()  # processing thread vs undo/redo/save requests
+        self.canvas_stale = False  # strokes were added while nothing was rendered
+        self.detector = htm.handDetector(maxHands=1, source=self.source, inferenceWidth=self.inference_width)
+
+    def reset(self):
         # Clear state
         self.canvas = None
+        self.alpha = None
+        self.ink_rect = None
+        self.canvas_stale = False
         self.prev_x, self.prev_y = 0, 0
-
-
-    def process_frame(self):
-        success, frame = self.cap.read()
-        if not success:
-            return None
-
-        frame = cv2.flip(frame, 1)
+        self.strokes = StrokeModel()
+
+    def new_canvas(self, shape):
+        self.canvas = np.zeros(shape, dtype=np.uint8)
+        self.alpha = np.zeros(shape[:2], dtype=np.uint8)
+        self.ink_rect = None
+        h, w = shape[:2]
+        if not self.strokes.width:
+            self.strokes.width, self.strokes.height = w, h
+        # Re-render existing strokes, scaled if the frame size changed
+        self.strokes.replay(self, w, h)
+
+    def undo(self):
+        with self.canvas_lock:
+            self.prev_x, self.prev_y = 0, 0
+            if self.strokes.undo():
+                if self.canvas is not None:
+                    self.new_canvas(self.canvas.shape)
+                self.emit("canvas", strokes=self.stroke_data())
+
+    def redo(self):
+        with self.canvas_lock:
+            self.prev_x, self.prev_y = 0, 0
+            if self.strokes.redo():
+                if self.canvas is not None:
+                    self.new_canvas(self.canvas.shape)
+                self.emit("canvas", strokes=self.stroke_data())
+
+    def stroke_data(self):
+        # Every stroke with normalized points, for clients that draw the canvas
+        w, h = self.strokes.width or self.wCam, self.strokes.height or self.hCam
+        data = []
+        for stroke in self.strokes.strokes:
+            points = (np.asarray(stroke.points, dtype=np.float32).reshape(-1, 2) / (w, h)).round(4)
+            data.append({"kind": "erase" if stroke.kind == ERASE else "draw",
+                         "color": list(stroke.color), "width": round(stroke.width / w, 4),
+                         "points": points.ravel().tolist()})
+        return data
+
+    def initial_events(self):
+        events = super().initial_events()
+        with self.canvas_lock:
+            events.append({"type": "canvas", "feature": self.name, "strokes": self.stroke_data()})
+        return events
+
+    def draw_line(self, p1, p2, color=(255, 0, 0), thickness=5):
+        cv2.line(self.canvas, p1, p2, color, thickness)
+        cv2.line(self.alpha, p1, p2, 255, thickness)
+        r = thickness // 2 + 1
+        self._grow_ink_rect(min(p1[0], p2[0]) - r, min(p1[1], p2[1]) - r,
+                            max(p1[0], p2[0]) + r + 1, max(p1[1], p2[1]) + r + 1)
+
+    def erase(self, center, radius=30):
+        cv2.circle(self.canvas, center, radius, (0, 0, 0), -1)
+        cv2.circle(self.alpha, center, radius, 0, -1)
+
+    def _grow_ink_rect(self, x0, y0, x1, y1):
+        h, w = self.alpha.shape
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if self.ink_rect is not None:
+            x0, y0 = min(x0, self.ink_rect[0]), min(y0, self.ink_rect[1])
+            x1, y1 = max(x1, self.ink_rect[2]), max(y1, self.ink_rect[3])
+        self.ink_rect = (x0, y0, x1, y1)
+
+    def composite(self, frame):
+        # The alpha mask is updated as strokes are drawn, so overlaying the
+        # canvas is one masked copy limited to the inked rectangle
+        if self.ink_rect is None:
+            return frame
+        x0, y0, x1, y1 = self.ink_rect
+        roi = frame[y0:y1, x0:x1]
+        cv2.copyTo(self.canvas[y0:y1, x0:x1], self.alpha[y0:y1, x0:x1], roi)
+        return frame
+
+    def process_frame(self, frame):
+        # Landmarks come from the shared hand service on the unmirrored frame
+        # (so other hand features can reuse them), drawn before the flip and
+        # mirrored in x for the canvas
+        with self.metrics.timer("inference"):
+            self.detector.findHands(frame, draw=self.render, frame_id=self.frame_id)
+        result = self.detector.results
+
+        if self.render:
+            frame = cv2.flip(frame, 1, dst=frame)
+        with self.canvas_lock:
+            return self._draw(frame, result)
+
+    def _draw(self, frame, result):
+        # Without rendering only the stroke model is updated (clients get the
+        # stroke events), the raster canvas is rebuilt once rendering resumes
         h, w, _ = frame.shape
-        if self.canvas is None or self.canvas.shape != frame.shape:
-            self.canvas = np.zeros_like(frame)
-
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        result = self.hands.process(rgb)
+        if self.render and (self.canvas is None or self.canvas.shape != frame.shape or self.canvas_stale):
+            self.new_canvas(frame.shape)
+            self.canvas_stale = False
+        elif not self.render:
+            self.canvas_stale = True
+            if not self.strokes.width:
+                self.strokes.width, self.strokes.height = w, h
 
         if result.multi_hand_landmarks:
             hand = result.multi_hand_landmarks[0]
-            self.draw_util.draw_landmarks(frame, hand, self.mp_hands.HAND_CONNECTIONS)
 
             index_tip = hand.landmark[8]
             index_bottom = hand.landmark[6]
             middle_tip = hand.landmark[12]
             middle_bottom = hand.landmark[10]
 
-            x, y = int(index_tip.x * w), int(index_tip.y * h)
+            x, y = self.smoother.update(((1 - index_tip.x) * w, index_tip.y * h), self.frame_time)
+            x, y = int(x), int(y)
             index_up = index_tip.y < index_bottom.y
             middle_up = middle_tip.y < middle_bottom.y
 
             if index_up and not middle_up:
                 if self.prev_x == 0 and self.prev_y == 0:
                     self.prev_x, self.prev_y = x, y
-                cv2.line(self.canvas, (self.prev_x, self.prev_y), (x, y), (255, 0, 0), 5)
+                    self.strokes.begin(DRAW, (255, 0, 0), 5)
+                self.strokes.add_point(x, y, self.frame_time)
+                if self.render:
+                    self.draw_line((self.prev_x, self.prev_y), (x, y))
+                self.emit("stroke", op="line", color=[255, 0, 0], width=round(5 / w, 4),
+                          points=[round(self.prev_x / w, 4), round(self.prev_y / h, 4),
+                                  round(x / w, 4), round(y / h, 4)])
                 self.prev_x, self.prev_y = x, y
+                self.set_gesture("draw")
             elif index_up and middle_up:
-                cv2.circle(self.canvas, (x, y), 30, (0, 0, 0), -1)
+                if self.strokes.current is None or self.strokes.current.kind != ERASE:
+                    self.strokes.begin(ERASE, width=60)
+                self.strokes.add_point(x, y, self.frame_time)
+                if self.render:
+                    self.erase((x, y))
+                self.emit("stroke", op="erase", width=round(60 / w, 4),
+                          points=[round(x / w, 4), round(y / h, 4)])
                 self.prev_x, self.prev_y = 0, 0
+                self.set_gesture("erase")
             else:
                 self.prev_x, self.prev_y = 0, 0
+                self.strokes.end()
+                self.smoother.reset()  # the next stroke starts at the fingertip
+                self.set_gesture("idle")
 
-        mask = cv2.cvtColor(self.canvas, cv2.COLOR_BGR2GRAY)
-        _, mask = cv2.threshold(mask, 20, 255, cv2.THRESH_BINARY)
-        inv_mask = cv2.bitwise_not(mask)
-        frame_bg = cv2.bitwise_and(frame, frame, mask=inv_mask)
-        drawing_fg = cv2.bitwise_and(self.canvas, self.canvas, mask=mask)
-        combined = cv2.add(frame_bg, drawing_fg)
-
-        return combined
-
-    def generate(self):
-        self.start_camera()
-        while self.streaming:
-            frame = self.process_frame()
-            if frame is None:
-                continue
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                continue
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        self.stop_camera()  # release webcam when loop ends
+        return self.composite(frame) if self.render else frame
 
     def save_canvas(self):
-        if self.canvas is not None:
-            filename = datetime.datetime.now().strftime("saved_drawings/drawing_%Y%m%d_%H%M%S.png")
-            cv2.imwrite(filename, self.canvas)
-            return filename
-        return None
+        # Written in the background, StrokeModel.load(filename).rasterize(w, h)
+        # renders it again at any resolution
+        with self.canvas_lock:
+            if not self.strokes.width:  # no frame seen yet
+                return None
+            snapshot = self.strokes.snapshot()
+        filename = datetime.datetime.now().strftime("saved_drawings/drawing_%Y%m%d_%H%M%S.npz")
+        self.writer.submit(filename, snapshot)
+        return filename
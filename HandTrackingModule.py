@@ -1,80 +1,180 @@
 import cv2
-import mediapipe as mp
 import time
 import math
+import numpy as np
+import hand_service
+import models
 
 class handDetector():
-    def __init__(self, mode=False, maxHands=2, detectionCon=0.5, trackCon=0.5):
+    def __init__(self, mode=False, maxHands=2, detectionCon=0.5, trackCon=0.5, source=0,
+                 trackInterval=0, roiMargin=0.3, inferenceWidth=None):
      self.mode = mode
      self.maxHands = maxHands
      self.detectionCon = detectionCon
      self.trackCon = trackCon
-
-     self.mpHands = mp.solutions.hands
-     self.hands = self.mpHands.Hands(
-        static_image_mode=self.mode,
-        max_num_hands=self.maxHands,
-        min_detection_confidence=self.detectionCon,
-        min_tracking_confidence=self.trackCon
-    )
-     self.mpDraw = mp.solutions.drawing_utils
+     self.source = source
+     self.inferenceWidth = inferenceWidth  # frames wider than this are downscaled for MediaPipe
+
+     # Tracking mode: when trackInterval > 0, landmarks run on a crop around
+     # the last hand box (grown by roiMargin of its size on every side) and a
+     # full-frame detection only happens every trackInterval frames, or as
+     # soon as the crop result stops being consistent (see roiConsistent)
+     self.trackInterval = trackInterval
+     self.roiMargin = roiMargin
+     self.trackBox = None  # last hand box, normalized xmin, ymin, xmax, ymax
+     self.framesTracked = 0
+
+     # Hands graphs are shared per camera and hand count, at MediaPipe's
+     # default confidences; detectionCon and trackCon only apply to the own
+     # graph of static image mode. MediaPipe itself is only loaded on the
+     # first findHands().
+     self.mpHands = None
+     self.hands = None
+     self.mpDraw = None
      self.tipIds = [4, 8, 12, 16, 20]
 
-    def findHands(self, img, draw=True):
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.hands.process(imgRGB)
-
+    def service(self):
+        if self.mode:
+            if self.hands is None:
+                self.hands = hand_service.HandLandmarkService(self.maxHands, self.detectionCon, self.trackCon,
+                                                              static_image_mode=True)
+            return self.hands
+        return hand_service.get_service(self.source, self.maxHands)
+
+    def findHands(self, img, draw=True, frame_id=None):
+        # frame_id lets the shared service reuse a result for the same frame
+        service = self.service()
+
+        roi = self.trackingRoi(img)
+        results = None
+        if roi is not None:
+            results = service.process(img, frame_id, roi, self.inferenceWidth)
+            if not self.roiConsistent(results, roi, img.shape):
+                results = None
+        if results is None:
+            results = service.process(img, frame_id, width=self.inferenceWidth)
+            self.framesTracked = 0
+        else:
+            self.framesTracked += 1
+        self.results = results.select(self.maxHands)
+
+        if self.trackInterval:
+            lm = self.results.landmarks
+            self.trackBox = None
+            if len(lm):
+                xy = lm[..., :2].reshape(-1, 2)
+                self.trackBox = (*xy.min(axis=0), *xy.max(axis=0))
+
+        if self.results.multi_hand_landmarks and draw and self.mpDraw is None:
+            mp = models.mediapipe()
+            self.mpHands, self.mpDraw = mp.solutions.hands, mp.solutions.drawing_utils
         if self.results.multi_hand_landmarks:
             for handLms in self.results.multi_hand_landmarks:
                 if draw:
                     self.mpDraw.draw_landmarks(img, handLms, self.mpHands.HAND_CONNECTIONS)
         return img
 
+    def trackingRoi(self, img):
+        # Pixel crop around the last hand box, None when a full frame is due
+        if not self.trackInterval or self.trackBox is None or self.framesTracked >= self.trackInterval:
+            return None
+        h, w = img.shape[:2]
+        xmin, ymin, xmax, ymax = self.trackBox
+        mx, my = (xmax - xmin) * self.roiMargin, (ymax - ymin) * self.roiMargin
+        x0, y0 = max(int((xmin - mx) * w), 0), max(int((ymin - my) * h), 0)
+        x1, y1 = min(int((xmax + mx) * w), w), min(int((ymax + my) * h), h)
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        return x0, y0, x1, y1
+
+    def roiConsistent(self, results, roi, shape, edge=0.02, resize=1.5):
+        # A crop result is kept while every hand lies inside the crop, clear of
+        # the crop edges that are not also frame edges (a hand there is leaving
+        # it), and its box kept about its size (not more than resize times
+        # larger or smaller). Anything else means a full-frame detection.
+        lm = results.landmarks
+        if len(lm) == 0 or self.trackBox is None:
+            return False
+        h, w = shape[:2]
+        x0, y0, x1, y1 = roi
+        xy = lm[..., :2].reshape(-1, 2) * (w, h)
+        (xmin, ymin), (xmax, ymax) = xy.min(axis=0), xy.max(axis=0)
+        mx, my = (x1 - x0) * edge, (y1 - y0) * edge
+        if ((x0 > 0 and xmin < x0 + mx) or (y0 > 0 and ymin < y0 + my) or
+                (x1 < w and xmax > x1 - mx) or (y1 < h and ymax > y1 - my)):
+            return False
+        bxmin, bymin, bxmax, bymax = self.trackBox
+        before = math.hypot((bxmax - bxmin) * w, (bymax - bymin) * h)
+        after = math.hypot(xmax - xmin, ymax - ymin)
+        return before > 0 and 1 / resize <= after / before <= resize
+
+    def findLandmarks(self, img, draw=True):
+        # Pixel landmarks of every hand as a (hands, 21, 3) float32 array, z is
+        # scaled like x as MediaPipe does
+        h, w = img.shape[:2]
+        self.landmarks = self.results.landmarks * np.array([w, h, w], dtype=np.float32)
+
+        if draw:
+            for cx, cy in self.landmarks[..., :2].reshape(-1, 2).astype(np.int32).tolist():
+                cv2.circle(img, (cx, cy), 5, (255, 0, 255), cv2.FILLED)
+        return self.landmarks
+
+    def findBBoxes(self, landmarks=None):
+        # (hands, 4) array of xmin, ymin, xmax, ymax
+        if landmarks is None:
+            landmarks = self.landmarks
+        xy = landmarks[..., :2]
+        return np.concatenate([xy.min(axis=1), xy.max(axis=1)], axis=1)
+
+    def findFingers(self, landmarks=None):
+        # (hands, 5) array with 1 for every raised finger, thumb first
+        if landmarks is None:
+            landmarks = self.landmarks
+        tips = np.asarray(self.tipIds)
+        thumb = landmarks[:, tips[0], 0] > landmarks[:, tips[0] - 1, 0]
+        others = landmarks[:, tips[1:], 1] < landmarks[:, tips[1:] - 2, 1]
+        return np.column_stack([thumb, others]).astype(np.int32)
+
+    def findDistances(self, p1, p2, landmarks=None):
+        # Distance between landmarks p1 and p2 for every hand, shape (hands,)
+        if landmarks is None:
+            landmarks = self.landmarks
+        d = landmarks[:, p2, :2] - landmarks[:, p1, :2]
+        return np.hypot(d[:, 0], d[:, 1])
+
+    def findPairwiseDistances(self, landmarks=None):
+        # (hands, 21, 21) distances between all landmark pairs of each hand
+        if landmarks is None:
+            landmarks = self.landmarks
+        xy = landmarks[..., :2]
+        d = xy[:, :, None, :] - xy[:, None, :, :]
+        return np.sqrt((d * d).sum(axis=-1))
+
+    # List based API, kept as thin wrappers over the arrays above
+
     def findPosition(self, img, handNo=0, draw=True):
         self.lmList = []
-        xList = []
-        yList = []
         bbox = []
 
-        if self.results.multi_hand_landmarks:
-            myHand = self.results.multi_hand_landmarks[handNo]
-            for id, lm in enumerate(myHand.landmark):
-                h, w, c = img.shape
-                cx, cy = int(lm.x * w), int(lm.y * h)
-                xList.append(cx)
-                yList.append(cy)
-                self.lmList.append([id, cx, cy])
-                if draw:
-                    cv2.circle(img, (cx, cy), 5, (255, 0, 255), cv2.FILLED)
-
-            xmin, xmax = min(xList), max(xList)
-            ymin, ymax = min(yList), max(yList)
-            bbox = xmin, ymin, xmax, ymax
+        landmarks = self.findLandmarks(img, draw=False)
+        if len(landmarks) > handNo:
+            self.lmPixels = landmarks[handNo:handNo + 1, :, :2].astype(np.int32)
+            points = self.lmPixels[0].tolist()
+            self.lmList = [[id, cx, cy] for id, (cx, cy) in enumerate(points)]
+            bbox = tuple(self.findBBoxes(self.lmPixels)[0].tolist())
 
             if draw:
+                for cx, cy in points:
+                    cv2.circle(img, (cx, cy), 5, (255, 0, 255), cv2.FILLED)
                 cv2.rectangle(img, (bbox[0] - 20, bbox[1] - 20),
                               (bbox[2] + 20, bbox[3] + 20), (0, 255, 0), 2)
 
         return self.lmList, bbox
 
     def fingersUp(self):
-        fingers = []
         if not hasattr(self, 'lmList') or len(self.lmList) == 0:
             return []
-
-        # Thumb
-        if self.lmList[self.tipIds[0]][1] > self.lmList[self.tipIds[0] - 1][1]:
-            fingers.append(1)
-        else:
-            fingers.append(0)
-
-        # Other 4 fingers
-        for id in range(1, 5):
-            if self.lmList[self.tipIds[id]][2] < self.lmList[self.tipIds[id] - 2][2]:
-                fingers.append(1)
-            else:
-                fingers.append(0)
-        return fingers
+        return self.findFingers(self.lmPixels)[0].tolist()
 
     def findDistance(self, p1, p2, img, draw=True):
         x1, y1 = self.lmList[p1][1], self.lmList[p1][2]
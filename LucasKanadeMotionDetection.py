@@ -4,96 +4,220 @@
 # Lucas-Kanade optical flow: tracks movement of those corners across video frames.
 # Visual overlay: draws motion paths as lines and circles on a mask, then overlays it on the video.
 # Live visualization: displays the optical flow in real time.
-# Reinitialization: if tracking points fall below a threshold, it re-detects them.
+# Reinitialization: grid cells that lost their points are topped up on keyframes
+# or when too few points are left, and old trails fade out over time.
+# Dense modes: Farneback or DIS flow on a downscaled frame, shown as a
+# direction (hue) / magnitude (brightness) heatmap.
 
 import cv2
 import numpy as np
+from camera_feature import CameraFeature
+
+class OpticalFlowVisualizer(CameraFeature):
+    name = "flow"
 
-class OpticalFlowVisualizer:
     def __init__(self):
-        self.cap = None
-        self.streaming = False
-        self.wCam, self.hCam = 640, 480
+        super().__init__()
         self.max_corners = 200
         self.quality_level = 0.01
         self.min_distance = 10
         self.prev_gray = None
         self.prev_points = None
         self.mask = None
-        self.color = np.random.randint(0, 255, (self.max_corners, 3))
-
-    def start_camera(self):
-        if self.cap is None or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(0)
-        self.streaming = True
-
-    def stop_camera(self):
-        self.streaming = False
-        if self.cap:
-            self.cap.release()
-            self.cap = None
+        self.point_colors = None
+        self.min_points = 50          # fewer tracked points than this triggers a top-up
+        self.keyframe_interval = 10   # also top up sparse grid cells every N frames
+        self.grid = (4, 4)            # cells used to find where points are missing
+        self.trail_fade = (8, 8, 8, 0)  # subtracted from the trails every frame
+        self.compensate_trails = True
+        self.flow_mode = "sparse"
+        self.dense_scale = 0.5   # dense flow runs at this fraction of the frame size
+        self.flow = None         # last dense flow field (at dense_scale)
+        self.motion_energy = 0.0 # mean flow magnitude of the last dense frame
+        self.dis = None
+        self.new_colors()
+
+    def new_colors(self):
+        # Arrows are drawn one polylines call per color, so points pick from a small palette
+        self.palette = np.random.randint(0, 255, (16, 3))
+
+    def reset(self):
         # Clear state
         self.prev_gray = None
         self.prev_points = None
         self.mask = None
-        self.color = np.random.randint(0, 255, (self.max_corners, 3))
-
-
-    def generate(self):
-        self.start_camera()
-        ret, prev_frame = self.cap.read()
-        if not ret:
-            return
+        self.point_colors = None
+        self.flow = None
+        self.flow_mode = "sparse"
+        self.new_colors()
+
+    def set_flow_mode(self, mode):
+        # "sparse" (Lucas-Kanade arrows), "farneback" or "dis"
+        if mode not in ("sparse", "farneback", "dis"):
+            mode = "sparse"
+        self.flow_mode = mode
+        self.prev_gray = None
 
-        self.prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-        self.prev_points = cv2.goodFeaturesToTrack(self.prev_gray, self.max_corners, self.quality_level, self.min_distance)
-        self.mask = np.zeros_like(prev_frame)
-
-        while self.streaming:
-            ret, frame = self.cap.read()
-            if not ret:
-                continue
-
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            curr_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.prev_points, None)
-
-            if curr_points is not None and self.prev_points is not None:
-                good_new = curr_points[status == 1]
-                good_prev = self.prev_points[status == 1]
-
-                for i, (new_pt, prev_pt) in enumerate(zip(good_new, good_prev)):
-                    x_new, y_new = new_pt.ravel()
-                    x_prev, y_prev = prev_pt.ravel()
-                    dx = x_new - x_prev
-                    dy = y_new - y_prev
-                    motion_magnitude = np.sqrt(dx**2 + dy**2)
-
-                    # Draw only if motion is significant
-                    if motion_magnitude > 2:
-                        cv2.arrowedLine(self.mask,
-                                        (int(x_prev), int(y_prev)),
-                                        (int(x_new), int(y_new)),
-                                        self.color[i].tolist(),
-                                        2,
-                                        tipLength=0.4)
-
-                output = cv2.add(frame, self.mask)
+    def process_frame(self, frame):
+        if self.flow_mode == "sparse":
+            return self.sparse_flow(frame)
+        return self.dense_flow(frame)
+
+    def draw_arrows(self, img, starts, ends, color_ids, thickness=2, tip_length=0.4):
+        # Same geometry as cv2.arrowedLine, but every arrow of one color is a
+        # single cv2.polylines call
+        d = starts - ends
+        angle = np.arctan2(d[:, 1], d[:, 0])
+        tip = np.hypot(d[:, 0], d[:, 1]) * tip_length
+        head1 = ends + tip[:, None] * np.column_stack([np.cos(angle + np.pi / 4), np.sin(angle + np.pi / 4)])
+        head2 = ends + tip[:, None] * np.column_stack([np.cos(angle - np.pi / 4), np.sin(angle - np.pi / 4)])
+        segments = np.concatenate([np.stack([starts, ends], axis=1),
+                                   np.stack([ends, head1], axis=1),
+                                   np.stack([ends, head2], axis=1)])
+        segments = segments.astype(np.int32)
+        ids = np.tile(color_ids, 3)
+        for cid in np.unique(ids):
+            cv2.polylines(img, segments[ids == cid], False, self.palette[cid].tolist(), thickness)
+
+    def gray(self, img):
+        # This frame's gray image; keep_gray() then keeps it as prev_gray
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=self.buffers.get("gray", img.shape[:2]))
+
+    def keep_gray(self, gray):
+        self.prev_gray = gray
+        self.buffers.swap("gray", "prev_gray")
+
+    def dense_flow(self, frame):
+        # dense_scale is relative to the inference size
+        h, w = frame.shape[:2]
+        scale = self.dense_scale * self.inference_scale(frame)
+        size = (round(w * scale), round(h * scale))
+        small = cv2.resize(frame, size, dst=self.buffers.get("small", (size[1], size[0], 3)),
+                           interpolation=cv2.INTER_AREA)
+        gray = self.gray(small)
+        if self.prev_gray is None or self.prev_gray.shape != gray.shape:
+            self.keep_gray(gray)
+            return frame
+
+        with self.metrics.timer("inference"):
+            if self.flow is not None and self.flow.shape[:2] != gray.shape:
+                self.flow = None
+            if self.flow_mode == "dis":
+                if self.dis is None:
+                    self.dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST)
+                self.flow = self.dis.calc(self.prev_gray, gray, self.flow)
             else:
-                output = frame.copy()
-
-            ret, buffer = cv2.imencode('.jpg', output)
-            if not ret:
-                continue
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-
-            self.prev_gray = gray
-            self.prev_points = (
-                good_new.reshape(-1, 1, 2)
-                if curr_points is not None and len(curr_points) >= 50
-                else cv2.goodFeaturesToTrack(self.prev_gray, self.max_corners, self.quality_level, self.min_distance)
-            )
-
-            if curr_points is None or len(curr_points) < 50:
-                self.mask = np.zeros_like(frame)
+                self.flow = cv2.calcOpticalFlowFarneback(self.prev_gray, gray, self.flow,
+                                                         0.5, 3, 15, 3, 5, 1.2, 0)
+        self.keep_gray(gray)
+
+        # cartToPolar would copy the strided x/y planes itself on every call
+        field = gray.shape
+        fx, fy = self.buffers.get("flow_x", field, np.float32), self.buffers.get("flow_y", field, np.float32)
+        np.copyto(fx, self.flow[..., 0])
+        np.copyto(fy, self.flow[..., 1])
+        magnitude, angle = cv2.cartToPolar(fx, fy,
+                                           magnitude=self.buffers.get("magnitude", field, np.float32),
+                                           angle=self.buffers.get("angle", field, np.float32),
+                                           angleInDegrees=True)
+        self.motion_energy = float(magnitude.mean()) / scale
+
+        # Hue from the direction, brightness from the magnitude, all in place
+        hsv = self.buffers.get("hsv", small.shape)
+        np.multiply(angle, 0.5, out=angle)
+        hsv[..., 0] = angle
+        hsv[..., 1] = 255
+        np.multiply(magnitude, 32, out=magnitude)
+        np.clip(magnitude, 0, 255, out=magnitude)
+        hsv[..., 2] = magnitude
+        heatmap = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=self.buffers.get("heatmap_small", small.shape))
+        heatmap = cv2.resize(heatmap, (w, h), dst=self.buffers.get("heatmap", frame.shape),
+                             interpolation=cv2.INTER_LINEAR)
+        return cv2.addWeighted(frame, 0.4, heatmap, 0.6, 0, dst=frame)
+
+    def sparse_flow(self, frame):
+        # Points are tracked at inference size, trails are drawn at frame size.
+        # Images go through self.buffers; the point arrays (LK output, the
+        # kept points, arrow geometry) are new every frame, but hold at most
+        # max_corners points whatever the frame size (test_allocation.py).
+        small, scale = self.inference_frame(frame)
+        gray = self.gray(small)
+        if (self.prev_gray is None or self.prev_gray.shape != gray.shape
+                or self.mask is None or self.mask.shape != frame.shape):
+            self.keep_gray(gray)
+            self.prev_points = np.empty((0, 1, 2), dtype=np.float32)
+            self.point_colors = np.empty(0, dtype=np.int64)
+            self.mask = self.buffers.zeros("mask", frame.shape)
+            self.frame_count = 0
+            self.top_up_points(gray)
+            return None
+
+        good_prev = good_new = np.empty((0, 2), dtype=np.float32)
+        if len(self.prev_points):
+            with self.metrics.timer("inference"):
+                curr_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.prev_points, None)
+            tracked = status.ravel() == 1
+            good_new = curr_points.reshape(-1, 2)[tracked]
+            good_prev = self.prev_points.reshape(-1, 2)[tracked]
+            self.point_colors = self.point_colors[tracked]
+
+        self.fade_trails(good_prev, good_new, scale)
+
+        # Draw only if motion is significant
+        d = good_new - good_prev
+        moving = np.hypot(d[:, 0], d[:, 1]) > 2 * scale
+        if moving.any():
+            self.draw_arrows(self.mask,
+                             np.trunc(good_prev[moving] / scale),
+                             np.trunc(good_new[moving] / scale),
+                             self.point_colors[moving])
+
+        output = cv2.add(frame, self.mask, dst=frame)
+
+        self.keep_gray(gray)
+        self.prev_points = good_new.reshape(-1, 1, 2)
+        self.frame_count += 1
+        if len(good_new) < self.min_points or self.frame_count % self.keyframe_interval == 0:
+            with self.metrics.timer("inference"):
+                self.top_up_points(gray)
+
+        return output
+
+    def top_up_points(self, gray):
+        # Search only the grid cells that have fewer than half their share of
+        # points, so a keyframe never pays for a full-frame re-detection
+        h, w = gray.shape
+        gx, gy = self.grid
+        per_cell = self.max_corners // (gx * gy)
+        pts = self.prev_points.reshape(-1, 2)
+        cx = np.clip((pts[:, 0] * gx / w).astype(np.int64), 0, gx - 1)
+        cy = np.clip((pts[:, 1] * gy / h).astype(np.int64), 0, gy - 1)
+        counts = np.bincount(cy * gx + cx, minlength=gx * gy).reshape(gy, gx)
+        sparse = counts < per_cell // 2
+        wanted = min(int((per_cell - counts[sparse]).sum()), self.max_corners - len(pts))
+        if wanted <= 0:
+            return
 
-        self.stop_camera()
+        # Nearest neighbour upscale of the cell grid, cell (i, j) covers the
+        # pixels with y * gy // h == i and x * gx // w == j
+        search_mask = cv2.resize(sparse.astype(np.uint8) * 255, (w, h), dst=self.buffers.get("search_mask", (h, w)),
+                                 interpolation=cv2.INTER_NEAREST)
+        new_points = cv2.goodFeaturesToTrack(gray, wanted, self.quality_level, self.min_distance, mask=search_mask)
+        if new_points is None:
+            return
+        self.prev_points = np.concatenate([self.prev_points, new_points.astype(np.float32)])
+        self.point_colors = np.concatenate(
+            [self.point_colors, np.random.randint(0, len(self.palette), len(new_points))])
+
+    def fade_trails(self, good_prev, good_new, scale=1.0):
+        # Trails fade out over a few frames instead of vanishing on re-detection.
+        # When the whole view moves (camera pan) they are shifted along with it.
+        if self.compensate_trails and len(good_new) >= 8:
+            M, _ = cv2.estimateAffinePartial2D(good_prev, good_new)
+            if M is not None:
+                M[:, 2] /= scale  # the shift in frame pixels
+            if M is not None and np.abs(M[:, 2]).max() > 1:
+                h, w = self.mask.shape[:2]
+                self.mask = cv2.warpAffine(self.mask, M, (w, h), dst=self.buffers.get("mask_warp", self.mask.shape))
+                self.buffers.swap("mask", "mask_warp")
+        cv2.subtract(self.mask, self.trail_fade, dst=self.mask)
@@ -0,0 +1,240 @@
+# OS actuation (cursor, clicks, system volume) off the vision loop.
+# Features hand their commands to an Actuator, whose thread makes the blocking
+# OS calls. Repeated commands of the same kind are merged, so only the latest
+# cursor position or volume level is applied, at most rate times a second.
+# One-shot commands (clicks) are not merged but debounced: a second click
+# within debounce seconds is dropped. An actuator can also keep the result of
+# a read command (the current volume) fresh for as long as someone asks for it.
+#
+# There is one actuator per OS device and process, shared by every session.
+# The backend is any object with the command methods; RecordingBackend is a
+# headless stand-in that records the calls instead of making them.
+
+import threading
+import time
+from collections import Counter, deque
+
+import metrics
+import models
+
+_NEVER = float("-inf")
+
+
+class Actuator:
+    def __init__(self, name, backend, rate=60.0, debounce=0.3, read=None, read_interval=0.25):
+        self.name = name
+        self.backend = backend
+        self.min_interval = 1.0 / rate
+        self.debounce = debounce
+        self.read = read
+        self.read_interval = read_interval
+        self.metrics = metrics.get_metrics(name)
+        self.value = getattr(backend, read)() if read else None
+
+        self.pending = {}         # command -> args, only the latest is kept
+        self.triggers = deque()   # one-shot commands, in order
+        self.last_run = {}        # command -> when it was last applied
+        self.last_trigger = {}    # command -> when it was last accepted
+        self.last_read = time.monotonic()
+        self.read_wanted = _NEVER
+        self.busy = False
+        self.errors = 0
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=f"actuator-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, command, *args):
+        # Applies command(*args) soon; replaces a pending call of the same command
+        with self.cond:
+            if command in self.pending:
+                self.metrics.count("coalesced")
+            self.pending[command] = args
+            self.cond.notify()
+
+    def trigger(self, command, *args):
+        # Queues a one-shot command, returns False if it was debounced
+        now = time.monotonic()
+        with self.cond:
+            if now - self.last_trigger.get(command, _NEVER) < self.debounce:
+                self.metrics.count("coalesced")
+                return False
+            self.last_trigger[command] = now
+            self.triggers.append((command, args))
+            self.cond.notify()
+        return True
+
+    def latest(self):
+        # Last result of the read command, refreshed by the thread while it is
+        # being asked for
+        now = time.monotonic()
+        with self.cond:
+            self.read_wanted = now
+            if now - self.last_read >= self.read_interval:
+                self.cond.notify()
+        return self.value
+
+    def flush(self, timeout=1.0):
+        # Waits until every queued command has been applied
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.pending or self.triggers or self.busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    return False
+        return True
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join(timeout=1.0)
+
+    def _next_batch(self):
+        # Blocks until there is something to do, returns the calls to make
+        # (None to stop). An empty batch means only the read is due.
+        with self.cond:
+            self.busy = False
+            self.cond.notify_all()
+            while self.running:
+                now = time.monotonic()
+                if self.triggers:
+                    # A click goes after every pending move, wherever the cursor is headed
+                    due = list(self.pending)
+                else:
+                    due = [c for c in self.pending if now - self.last_run.get(c, _NEVER) >= self.min_interval]
+                read_due = (self.read and now - self.read_wanted < 1.0
+                            and now - self.last_read >= self.read_interval)
+                if due or self.triggers or read_due:
+                    batch = [(c, self.pending.pop(c)) for c in due] + list(self.triggers)
+                    self.triggers.clear()
+                    for command in due:
+                        self.last_run[command] = now
+                    self.busy = True
+                    return batch
+
+                timeout = None
+                if self.pending:
+                    timeout = min(self.last_run[c] + self.min_interval for c in self.pending) - now
+                if self.read and now - self.read_wanted < 1.0:
+                    until_read = self.last_read + self.read_interval - now
+                    timeout = until_read if timeout is None else min(timeout, until_read)
+                self.cond.wait(timeout)
+            return None
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            for command, args in batch:
+                self._call(command, *args)
+            if self.read and time.monotonic() - self.last_read >= self.read_interval:
+                value = self._call(self.read)
+                if value is not None:
+                    self.value = value
+                self.last_read = time.monotonic()
+
+    def _call(self, command, *args):
+        start = time.perf_counter()
+        try:
+            result = getattr(self.backend, command)(*args)
+        except Exception as e:
+            # Keep the thread alive, a flaky OS call should not end actuation
+            self.errors += 1
+            if self.errors == 1:
+                print(f"{self.name} actuator: {command} failed: {type(e).__name__}: {e}")
+            return None
+        self.metrics.record("actuate", time.perf_counter() - start)
+        self.metrics.count("actuated")
+        return result
+
+
+class AutopyMouse:
+    def __init__(self, autopy):
+        self.autopy = autopy
+
+    def screen_size(self):
+        return self.autopy.screen.size()
+
+    def move(self, x, y):
+        self.autopy.mouse.move(x, y)
+
+    def click(self):
+        self.autopy.mouse.click()
+
+
+class EndpointVolume:
+    # The Windows master volume, as a 0-1 scalar
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def get_volume(self):
+        return self.endpoint.GetMasterVolumeLevelScalar()
+
+    def set_volume(self, level):
+        self.endpoint.SetMasterVolumeLevelScalar(level, None)
+
+
+class RecordingBackend:
+    # Headless stand-in for both devices: records every call
+    def __init__(self, screen=(1920.0, 1080.0), volume=0.5):
+        self.calls = []
+        self.screen = screen
+        self.volume = volume
+
+    def screen_size(self):
+        return self.screen
+
+    def move(self, x, y):
+        self.calls.append(("move", x, y))
+
+    def click(self):
+        self.calls.append(("click",))
+
+    def get_volume(self):
+        self.calls.append(("get_volume",))
+        return self.volume
+
+    def set_volume(self, level):
+        self.calls.append(("set_volume", level))
+        self.volume = level
+
+    def counts(self):
+        return Counter(call[0] for call in self.calls)
+
+
+def open_endpoint_volume():
+    # Windows only: pycaw and comtypes are imported here, so the other
+    # features keep working where they are missing
+    from ctypes import cast, POINTER
+    from comtypes import CLSCTX_ALL
+    from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+
+    devices = AudioUtilities.GetSpeakers()
+    interface = devices.Activate(
+        IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+    return cast(interface, POINTER(IAudioEndpointVolume))
+
+
+def mouse():
+    return models.get(("actuator", "mouse"),
+                      lambda: Actuator("mouse", AutopyMouse(models.module("autopy"))))
+
+
+def volume():
+    # Volume moves in 10% steps, a few updates a second are plenty
+    return models.get(("actuator", "volume"),
+                      lambda: Actuator("volume", EndpointVolume(models.get("endpoint_volume", open_endpoint_volume)),
+                                       rate=10.0, read="get_volume"))
+
+
+def install_recording(backend=None, devices=("mouse", "volume")):
+    # Replaces the OS actuators with ones driving a recording backend, for
+    # headless runs; returns the backend
+    backend = backend or RecordingBackend()
+    if "mouse" in devices:
+        models.put(("actuator", "mouse"), Actuator("mouse", backend))
+    if "volume" in devices:
+        models.put(("actuator", "volume"), Actuator("volume", backend, rate=10.0, read="get_volume"))
+    return backend
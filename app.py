@@ -1,128 +1,179 @@
-from flask import Flask, render_template, Response, request, jsonify
+from flask import Flask, render_template, Response, request, jsonify, g, abort
 from AirDrawingCanvas import AirDrawingCanvas
 from LucasKanadeMotionDetection import OpticalFlowVisualizer
 from Filters import FilterCamera
 from face_detection import FaceDetection
 from volume_control import VolumeControl
 from mouse_control import MouseControl
+from sessions import COOKIE_NAME, SessionManager
+import frame_bus
+import frame_sources
+import metrics
+import models
+import scheduler
 import os
 
 app = Flask(__name__)
-drawing_app = AirDrawingCanvas()
-flow_app = OpticalFlowVisualizer()
-filter_app = FilterCamera()
-face_app = FaceDetection()
-volume_app = VolumeControl()
-mouse_app = MouseControl()
+
+# Cameras are named in GESTUREFUSION_SOURCES (see frame_sources.py);
+# GESTUREFUSION_FEATURE_SOURCES=face=side,drawing=front picks each feature's
+# default one, and ?source=<name> on any feature route another one
+_feature_sources = os.environ.get("GESTUREFUSION_FEATURE_SOURCES", "")
+
+# Every client gets its own drawing canvas, filter/flow mode, mouse and volume
+# state; the camera and the models behind them are shared (see sessions.py)
+sessions = SessionManager({
+    "drawing": AirDrawingCanvas,
+    "flow": OpticalFlowVisualizer,
+    "filter": FilterCamera,
+    "face": FaceDetection,
+    "volume": VolumeControl,
+    "mouse": MouseControl,
+}, sources=dict(item.split("=", 1) for item in _feature_sources.split(",") if item))
+
+# Models load when a feature shows its first frame. GESTUREFUSION_WARMUP=all
+# (or a list such as drawing,face) loads them in the background at startup.
+_warmup = os.environ.get("GESTUREFUSION_WARMUP", "")
+if _warmup:
+    sessions.warm_up(None if _warmup == "all" else _warmup.split(","))
+
+def current_session():
+    if "session" not in g:
+        g.session = sessions.get(request.cookies.get(COOKIE_NAME))
+    return g.session
+
+def requested_source():
+    source = request.args.get("source")
+    if source is not None and source not in frame_sources.SOURCES:
+        abort(404, description="unknown source")
+    return source
+
+def feature(name):
+    return current_session().feature(name, requested_source())
+
+def stream(name):
+    return Response(current_session().stream(name, requested_source()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.after_request
+def set_session_cookie(response):
+    session = g.get("session")
+    if session is not None and request.cookies.get(COOKIE_NAME) != session.id:
+        response.set_cookie(COOKIE_NAME, session.id, httponly=True, samesite="Lax")
+    return response
 
 @app.route('/')
 def index():
+    current_session()
     return render_template('index.html')
 
 @app.route('/video_feed_drawing')
 def video_feed_drawing():
-    return Response(drawing_app.generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream('drawing')
 
 @app.route('/video_feed_flow')
 def video_feed_flow():
-    return Response(flow_app.generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream('flow')
 
 @app.route('/video_feed_filter')
 def video_feed_filter():
-    return Response(filter_app.generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream('filter')
 
 @app.route('/video_feed_face')
 def video_feed_face():
-    return Response(face_app.generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream('face')
 
 @app.route('/video_feed_volume')
 def video_feed_volume():
-    return Response(volume_app.generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream('volume')
 
 @app.route('/video_feed_mouse')
 def video_feed_mouse():
-    return Response(mouse_app.generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream('mouse')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # JSON by default, Prometheus text with ?format=prometheus
+    if request.args.get("format") == "prometheus":
+        return Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+    return jsonify({**metrics.snapshot_all(), "sessions": sessions.stats(), "models": models.status(),
+                    "capture": frame_bus.status(), "sources": scheduler.status()})
+
+@app.route('/sources')
+def sources_endpoint():
+    # Registered cameras and, for those in use, their throughput and cores
+    return jsonify({"sources": {name: str(source) for name, source in frame_sources.SOURCES.items()},
+                    "running": scheduler.status()})
 
 @app.route('/set_filter_mode', methods=['POST'])
 def set_filter_mode():
     filter_mode = request.json.get("mode", "original")
-    filter_app.set_filter_mode(filter_mode)
-    return jsonify({"success": True})
-
-@app.route('/save_canvas', methods=['POST'])
-def save_canvas():
-    filename = drawing_app.save_canvas()
-    return jsonify({"success": True, "filename": filename}) if filename else jsonify({"success": False})
-
-@app.route('/stop_camera_drawing', methods=['POST'])
-def stop_camera_drawing():
-    drawing_app.stop_camera()
+    feature('filter').set_filter_mode(filter_mode)
     return jsonify({"success": True})
 
-@app.route('/stop_camera_flow', methods=['POST'])
-def stop_camera_flow():
-    flow_app.stop_camera()
+@app.route('/set_flow_mode', methods=['POST'])
+def set_flow_mode():
+    flow_mode = request.json.get("mode", "sparse")
+    feature('flow').set_flow_mode(flow_mode)
     return jsonify({"success": True})
 
-@app.route('/stop_camera_filter', methods=['POST'])
-def stop_camera_filter():
-    filter_app.stop_camera()
+@app.route('/set_face_workers', methods=['POST'])
+def set_face_workers():
+    # Processes searching tiles of each full-size frame, 0 for none
+    try:
+        workers = int(request.json.get("workers", 0))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "workers must be a number"}), 400
+    feature('face').set_workers(max(workers, 0))
+    return jsonify({"success": True, "workers": max(workers, 0)})
+
+@app.route('/set_encoding_<name>', methods=['POST'])
+def set_encoding(name):
+    # JPEG quality (40-100) and output scale (0.1-1.0) of a feature's stream
+    if name not in sessions.factories:
+        return jsonify({"success": False, "error": "unknown feature"}), 404
+    encoder = feature(name).encoder
+    encoder.configure(request.json.get("quality"), request.json.get("scale"))
+    return jsonify({"success": True, **encoder.state()})
+
+@app.route('/set_smoothing_<name>', methods=['POST'])
+def set_smoothing(name):
+    # {"filter": "one_euro" | "kalman" | "exponential", ...parameters}, see smoothing.py
+    if name not in sessions.factories or not sessions.factories[name].smoothing:
+        return jsonify({"success": False, "error": "unknown feature"}), 404
+    try:
+        feature(name).set_smoothing(request.json)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     return jsonify({"success": True})
 
-@app.route('/stop_camera_face', methods=['POST'])
-def stop_camera_face():
-    face_app.stop_camera()
-    return jsonify({"success": True})
+@app.route('/save_canvas', methods=['POST'])
+def save_canvas():
+    filename = feature('drawing').save_canvas()
+    return jsonify({"success": True, "filename": filename}) if filename else jsonify({"success": False})
 
-@app.route('/stop_camera_volume', methods=['POST'])
-def stop_camera_volume():
-    volume_app.stop_camera()
+@app.route('/undo_canvas', methods=['POST'])
+def undo_canvas():
+    feature('drawing').undo()
     return jsonify({"success": True})
 
-@app.route('/stop_camera_mouse', methods=['POST'])
-def stop_camera_mouse():
-    mouse_app.stop_camera()
+@app.route('/redo_canvas', methods=['POST'])
+def redo_canvas():
+    feature('drawing').redo()
     return jsonify({"success": True})
 
-@app.route('/stop_camera_<feature>', methods=['POST'])
-def stop_camera(feature):
-    if feature == 'drawing':
-        drawing_app.stop_camera()
-    elif feature == 'flow':
-        flow_app.stop_camera()
-    elif feature == 'filter':
-        filter_app.stop_camera()
-    elif feature == 'face':
-        face_app.stop_camera()
-    elif feature == 'volume':
-        volume_app.stop_camera()
-    elif feature == 'mouse':
-        mouse_app.stop_camera()
-
+@app.route('/stop_camera_<name>', methods=['POST'])
+def stop_camera(name):
+    # Only this client's stream, shared features stop with their last viewer
+    if name in sessions.factories:
+        current_session().stop(name, requested_source())
     return jsonify({"success": True})
 
 
-@app.route('/start_camera_<feature>', methods=['POST'])
-def start_camera(feature):
-    if feature == 'drawing':
-        drawing_app.stop_camera()  # Stop and reinitialize drawing camera
-        drawing_app.start_camera()
-    elif feature == 'flow':
-        flow_app.stop_camera()
-        flow_app.start_camera()
-    elif feature == 'filter':
-        filter_app.stop_camera()
-        filter_app.start_camera()
-    elif feature == 'face':
-        face_app.stop_camera()
-        face_app.start_camera()
-    elif feature == 'volume':
-        volume_app.stop_camera()
-        volume_app.start_camera()
-    elif feature == 'mouse':
-        mouse_app.stop_camera()
-        mouse_app.start_camera()
-
+@app.route('/start_camera_<name>', methods=['POST'])
+def start_camera(name):
+    if name in sessions.factories:
+        current_session().restart(name, requested_source())  # Stop and reinitialize this client's camera
     return jsonify({"success": True})
 
 
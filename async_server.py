@@ -0,0 +1,230 @@
+# Asyncio serving mode (aiohttp) for many viewers.
+# Serves the same features as app.py, but every viewer is a coroutine waiting
+# on the feature's broadcaster instead of a worker thread:
+#
+#   /ws/<feature>           WebSocket: JPEG frames as binary messages and JSON
+#                           events (landmarks, gestures) as text messages
+#       ?video=0            events only (client-side rendering: the feature
+#                           then skips its overlays and encoding)
+#       ?events=0           frames only
+#       ?ack=1&window=2     the client sends "ack" after showing each frame and
+#                           at most window frames are in flight; frames that
+#                           arrive meanwhile are skipped and the encoder backs off
+#   /video_feed_<feature>   the MJPEG streams, unchanged for existing clients
+#   anything else           passed to the Flask app (page, control routes, /metrics)
+#
+# Every feature route takes ?source=<name> to read another registered camera.
+#
+# Viewers are matched to their session by the cookie the page set, so each
+# client streams its own feature instances.
+#
+#   python async_server.py --host 0.0.0.0 --port 5000
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+
+from aiohttp import WSMsgType, web
+from multidict import CIMultiDict
+
+import app as flask_app
+import frame_sources
+from encoder import jpeg_payload
+from sessions import COOKIE_NAME
+
+
+def _feature(request):
+    name = request.match_info["feature"]
+    if name not in flask_app.sessions.factories:
+        raise web.HTTPNotFound(text="unknown feature")
+    source = request.query.get("source")  # a registered camera name, see frame_sources
+    if source is not None and source not in frame_sources.SOURCES:
+        raise web.HTTPNotFound(text="unknown source")
+    session = flask_app.sessions.get(request.cookies.get(COOKIE_NAME))
+    return session, session.feature(name, source)
+
+
+async def _add_viewer(session, feature, video=True):
+    # Starting a camera may join old pipeline threads, keep it off the loop
+    session.open_stream()
+    await asyncio.get_running_loop().run_in_executor(None, feature.add_viewer, video)
+
+
+def _remove_viewer(session, feature, video=True):
+    session.close_stream()
+    asyncio.get_running_loop().run_in_executor(None, feature.remove_viewer, video)
+
+
+async def video_feed(request):
+    session, feature = _feature(request)
+    response = web.StreamResponse(headers={"Content-Type": "multipart/x-mixed-replace; boundary=frame"})
+    await response.prepare(request)
+    await _add_viewer(session, feature)
+    last_seq = 0
+    try:
+        while not feature.viewer_failed():
+            seq, chunk = await feature.broadcaster.wait_next_async(last_seq)
+            if chunk is None:
+                continue
+            feature.record_delivery(last_seq, seq)
+            last_seq = seq
+            start = time.perf_counter()
+            await response.write(chunk)  # waits while the socket buffer is full
+            feature.metrics.record("send", time.perf_counter() - start)
+            feature.metrics.count("sent")
+    except ConnectionResetError:
+        pass
+    finally:
+        _remove_viewer(session, feature)
+    return response
+
+
+class WebSocketViewer:
+    def __init__(self, feature, ws, window=None):
+        self.feature = feature
+        self.ws = ws
+        self.window = window  # None: rely on the socket's own flow control
+        self.in_flight = 0
+        self.acked = asyncio.Event()
+
+    async def send_frames(self):
+        feature = self.feature
+        last_seq = 0
+        while not self.ws.closed and not feature.viewer_failed():
+            while self.window and self.in_flight >= self.window:
+                self.acked.clear()
+                await self.acked.wait()
+            seq, chunk = await feature.broadcaster.wait_next_async(last_seq)
+            if chunk is None:
+                continue
+            feature.record_delivery(last_seq, seq)
+            last_seq = seq
+            start = time.perf_counter()
+            await self.ws.send_bytes(jpeg_payload(chunk))
+            feature.metrics.record("send", time.perf_counter() - start)
+            feature.metrics.count("sent")
+            self.in_flight += 1
+
+    async def send_events(self):
+        events = self.feature.events
+        last_seq = events.add_listener()
+        try:
+            for event in self.feature.initial_events():
+                await self.ws.send_str(json.dumps(event, separators=(",", ":")))
+            while not self.ws.closed:
+                last_seq, texts = await events.wait_after_async(last_seq)
+                for text in texts:
+                    await self.ws.send_str(text)
+        finally:
+            events.remove_listener()
+
+    async def receive(self):
+        async for msg in self.ws:
+            if msg.type == WSMsgType.TEXT and msg.data == "ack":
+                self.in_flight = max(self.in_flight - 1, 0)
+                self.acked.set()
+            elif msg.type == WSMsgType.ERROR:
+                break
+
+
+async def websocket(request):
+    session, feature = _feature(request)
+    query = request.query
+    window = int(query.get("window", 2)) if query.get("ack") == "1" else None
+    video = query.get("video") != "0"
+    ws = web.WebSocketResponse(heartbeat=30, max_msg_size=4096)
+    await ws.prepare(request)
+    await _add_viewer(session, feature, video)
+
+    viewer = WebSocketViewer(feature, ws, window)
+    senders = []
+    if video:
+        senders.append(asyncio.ensure_future(viewer.send_frames()))
+    if query.get("events") != "0":
+        senders.append(asyncio.ensure_future(viewer.send_events()))
+    try:
+        await viewer.receive()
+    finally:
+        for task in senders:
+            task.cancel()
+        await asyncio.gather(*senders, return_exceptions=True)
+        _remove_viewer(session, feature, video)
+    return ws
+
+
+def _call_flask(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"], response["headers"] = status, headers
+
+    result = flask_app.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return int(response["status"].split(None, 1)[0]), response["headers"], body
+
+
+async def flask_route(request):
+    # Minimal WSGI bridge for the short request/response routes of app.py
+    body = await request.read()
+    host, _, port = request.host.partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or ("443" if request.secure else "80"),
+        "SERVER_PROTOCOL": "HTTP/%d.%d" % request.version,
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = value
+
+    status, headers, data = await asyncio.get_running_loop().run_in_executor(None, _call_flask, environ)
+    headers = CIMultiDict((k, v) for k, v in headers if k.lower() != "content-length")
+    return web.Response(status=status, headers=headers, body=data)
+
+
+async def _shutdown(app):
+    flask_app.sessions.close()
+
+
+def make_app():
+    app = web.Application()
+    app.router.add_get("/ws/{feature}", websocket)
+    app.router.add_get("/video_feed_{feature}", video_feed)
+    app.router.add_route("*", "/{tail:.*}", flask_route)
+    app.on_shutdown.append(_shutdown)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve GestureFusion with asyncio and WebSockets")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    os.makedirs("saved_drawings", exist_ok=True)
+    web.run_app(make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
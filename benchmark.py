@@ -0,0 +1,316 @@
+# Offline benchmark: replays a fixed clip through the feature pipelines without
+# a webcam, browser or Flask, and reports frames/sec, the per-frame latency
+# distribution and peak Python-side memory for each one.
+#
+#   python benchmark.py                                  # synthetic 640x480 clip
+#   python benchmark.py --source clips/hand.mp4 --frames 300
+#   python benchmark.py --features drawing,hands --json results.json
+#   python benchmark.py --baseline results.json          # exit 1 on a regression
+#   python benchmark.py --source clips/hand.mp4 --features hands_full,hands_roi
+#                                                        # crop tracking against full frames
+#   python benchmark.py --max-alloc-kb 64                # exit 1 when a loop allocates per frame
+#                                                        # (test_allocation.py checks the headless ones)
+#   python benchmark.py --source synthetic:1280x720 --features face,face_1w,face_2w,face_4w
+#                                                        # the served face path with the tiled detector
+#
+# The clip is decoded up front, so the numbers cover process_frame and the
+# feature's FrameEncoder only. Mouse and volume control run against a recording
+# actuator backend when autopy or pycaw is not installed (or with --headless),
+# and the calls they would have made are counted instead.
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import actuator
+import frame_sources
+from camera_feature import CameraFeature
+
+HEADLESS = actuator.RecordingBackend()
+
+
+def install_headless_stubs(force=False):
+    # Swaps the mouse and volume actuators for recording ones when autopy or
+    # pycaw is missing. Only used by the benchmark so mouse and volume control
+    # can run on machines without a desktop session or Windows audio.
+    devices = []
+    if force or importlib.util.find_spec("autopy") is None:
+        devices.append("mouse")
+    if force or importlib.util.find_spec("pycaw") is None or importlib.util.find_spec("comtypes") is None:
+        devices.append("volume")
+    actuator.install_recording(HEADLESS, devices)
+    return devices
+
+
+class HandTrackingPath(CameraFeature):
+    # The landmark path the gesture features share, without any actuation
+    name = "hands"
+
+    def __init__(self, maxHands=2, trackInterval=0):
+        super().__init__()
+        import HandTrackingModule as htm
+        self.detector = htm.handDetector(maxHands=maxHands, source=self.source, trackInterval=trackInterval,
+                                         inferenceWidth=self.inference_width)
+
+    def process_frame(self, img):
+        with self.metrics.timer("inference"):
+            img = self.detector.findHands(img, frame_id=self.frame_id)
+        lmList, bbox = self.detector.findPosition(img)
+        if lmList:
+            self.detector.fingersUp()
+            self.detector.findDistance(4, 8, img)
+        return img
+
+
+def _drawing():
+    from AirDrawingCanvas import AirDrawingCanvas
+    return AirDrawingCanvas()
+
+
+def _flow(mode):
+    def make():
+        from LucasKanadeMotionDetection import OpticalFlowVisualizer
+        feature = OpticalFlowVisualizer()
+        feature.set_flow_mode(mode)
+        return feature
+    return make
+
+
+def _filter(mode):
+    def make():
+        from Filters import FilterCamera
+        feature = FilterCamera()
+        feature.set_filter_mode(mode)
+        return feature
+    return make
+
+
+def _face(tracking, workers=0):
+    def make():
+        from face_detection import FaceDetection
+        feature = FaceDetection()
+        feature.tracking = tracking
+        feature.workers = workers  # the pool starts in load()
+        return feature
+    return make
+
+
+def _mouse():
+    from mouse_control import MouseControl
+    return MouseControl()
+
+
+def _volume():
+    from volume_control import VolumeControl
+    return VolumeControl()
+
+
+CASES = {
+    "drawing": _drawing,
+    "flow": _flow("sparse"),
+    "flow_dis": _flow("dis"),
+    "filter_blur": _filter("blur"),
+    "filter_vintage": _filter("vintage"),
+    "filter_edges": _filter("edges"),
+    "face": _face(True),
+    "face_full": _face(False),
+    "face_1w": _face(True, 1),
+    "face_2w": _face(True, 2),
+    "face_4w": _face(True, 4),
+    "hands": HandTrackingPath,
+    # One hand on the full frame every frame, and on a crop around it as
+    # MouseControl does; needs a clip with a hand in it (--source)
+    "hands_full": lambda: HandTrackingPath(1),
+    "hands_roi": lambda: HandTrackingPath(1, trackInterval=10),
+    "mouse": _mouse,
+    "volume": _volume,
+}
+DEFAULT_CASES = ("drawing", "flow", "flow_dis", "filter_blur", "filter_vintage",
+                 "face", "face_full", "hands")
+
+
+def load_frames(source, count):
+    cap = frame_sources.open_source(source, realtime=False, loop=True)
+    frames = []
+    while len(frames) < count:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(frame.copy())
+    cap.release()
+    return frames
+
+
+def _distribution(seconds):
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"mean_ms": float(ms.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+            "p99_ms": float(p99), "max_ms": float(ms.max())}
+
+
+def run_case(factory, frames, warmup=10, memory_frames=100, encode=True):
+    feature = factory()
+    # Model loading is not part of the per-frame numbers, and a feature whose
+    # backend is missing would only time its error frame
+    if not feature.ensure_loaded():
+        raise RuntimeError(feature.error)
+    for i, frame in enumerate(frames[:warmup]):
+        feature._process(i + 1, time.perf_counter(), frame.copy())
+
+    process, encoding = [], []
+    sent_bytes = deduplicated = 0
+    for i, frame in enumerate(frames):
+        img = frame.copy()
+        start = time.perf_counter()
+        out = feature._process(warmup + i + 1, start, img)
+        process.append(time.perf_counter() - start)
+        if encode and out is not None:
+            start = time.perf_counter()
+            chunk = feature.encoder.encode(out)
+            encoding.append(time.perf_counter() - start)
+            if chunk is None:
+                deduplicated += 1
+            else:
+                sent_bytes += len(chunk)
+
+    # Memory is measured on a separate pass, tracemalloc slows the Python side
+    # of every frame down too much to time the same frames with it on. Frames
+    # arrive in one reused buffer, as from the pipeline's pool, and alloc is
+    # the most memory process_frame had allocated at once on top of what it
+    # already held: near zero when every per-frame array is reused.
+    img = np.empty_like(frames[0])
+    allocated = []
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    peak = 0
+    for i, frame in enumerate(frames[:memory_frames]):
+        if frame.shape != img.shape:
+            img = np.empty_like(frame)
+        np.copyto(img, frame)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        out = feature._process(warmup + len(frames) + i + 1, time.perf_counter(), img)
+        current, frame_peak = tracemalloc.get_traced_memory()
+        allocated.append(frame_peak - before)
+        if encode and out is not None:
+            feature.encoder.encode(out)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    feature.stop_camera()
+    if getattr(feature, "parallel", None):
+        feature.parallel.close()
+
+    total = sum(process) + sum(encoding)
+    result = {"frames": len(process), "fps": len(process) / total if total else 0.0,
+              "process": _distribution(process), "peak_memory_mb": (peak - base) / 2 ** 20}
+    if allocated:
+        result["alloc_kb_per_frame"] = float(np.median(allocated)) / 1024
+    if encoding:
+        result["encode"] = _distribution(encoding)
+        result["kb_per_frame"] = sent_bytes / 1024 / max(len(encoding) - deduplicated, 1)
+        result["deduplicated"] = deduplicated
+    stages = feature.metrics.snapshot()["stages"]
+    if "inference" in stages:
+        result["inference_p50_ms"] = stages["inference"]["p50_ms"]
+    return result
+
+
+def compare(results, baseline, tolerance):
+    # A case regresses when its fps drops, or its p95 latency grows, by more
+    # than tolerance relative to the baseline run
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or "error" in result or "error" in base:
+            continue
+        if result["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(f"{name}: fps {base['fps']:.1f} -> {result['fps']:.1f}")
+        if result["process"]["p95_ms"] > base["process"]["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['process']['p95_ms']:.2f} ms -> "
+                               f"{result['process']['p95_ms']:.2f} ms")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'case':<16}{'fps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'infer ms':>10}{'enc ms':>8}{'KB/frame':>10}{'peak MB':>9}{'alloc KB':>10}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<16}  {r['error']}")
+            continue
+        p = r["process"]
+        print(f"{name:<16}{r['fps']:>8.1f}{p['p50_ms']:>9.2f}{p['p95_ms']:>9.2f}{p['p99_ms']:>9.2f}"
+              f"{p['max_ms']:>9.2f}{r.get('inference_p50_ms', 0.0):>10.2f}"
+              f"{r.get('encode', {}).get('p50_ms', 0.0):>8.2f}{r.get('kb_per_frame', 0.0):>10.1f}"
+              f"{r['peak_memory_mb']:>9.2f}{r.get('alloc_kb_per_frame', 0.0):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a clip through the feature pipelines and report fps, latency and memory")
+    parser.add_argument("--source", default="synthetic",
+                        help="video file, image directory or synthetic[:WxH] (default: synthetic)")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--memory-frames", type=int, default=100)
+    parser.add_argument("--features", default=",".join(DEFAULT_CASES),
+                        help="comma separated cases, any of: " + ", ".join(CASES))
+    parser.add_argument("--no-encode", action="store_true", help="skip JPEG encoding")
+    parser.add_argument("--headless", action="store_true",
+                        help="use the recording actuators even if autopy and pycaw are installed")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--max-alloc-kb", type=float,
+                        help="fail when a case allocates more than this per frame in steady state")
+    args = parser.parse_args()
+
+    stubbed = install_headless_stubs(force=args.headless)
+    if stubbed:
+        print("headless stand-ins:", ", ".join(stubbed))
+
+    frames = load_frames(args.source, args.frames)
+    if not frames:
+        sys.exit(f"no frames could be read from {args.source!r}")
+    h, w = frames[0].shape[:2]
+    print(f"{len(frames)} frames of {w}x{h} from {args.source}")
+
+    results = {}
+    for name in (n.strip() for n in args.features.split(",")):
+        if name not in CASES:
+            results[name] = {"error": "unknown case"}
+            continue
+        try:
+            results[name] = run_case(CASES[name], frames, args.warmup, args.memory_frames,
+                                     encode=not args.no_encode)
+        except Exception as e:  # one broken feature should not hide the others
+            results[name] = {"error": f"{type(e).__name__}: {' '.join(str(e).split())}"}
+    print_table(results)
+    if HEADLESS.calls:
+        print("headless calls:", ", ".join(f"{k}={v}" for k, v in sorted(HEADLESS.counts().items())))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"source": str(args.source), "frames": len(frames), "size": [w, h],
+                       "results": results}, f, indent=2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+    if args.max_alloc_kb is not None:
+        regressions += [f"{name}: {r['alloc_kb_per_frame']:.1f} KB allocated per frame"
+                        for name, r in results.items() if r.get("alloc_kb_per_frame", 0.0) > args.max_alloc_kb]
+    for line in regressions:
+        print("REGRESSION", line)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
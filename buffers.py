@@ -0,0 +1,78 @@
+# Reusable arrays for one feature pipeline.
+# Every frame a feature needs the same handful of frame-sized arrays: the
+# captured frame, gray and RGB conversions, masks, heatmaps. A BufferPool hands
+# out the same array for the same name as long as shape and dtype stay the same,
+# and OpenCV writes into it through dst=, so steady-state processing allocates
+# (almost) nothing and the allocator and GC stay out of the frame loop:
+#
+#   gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.buffers.get("gray", frame.shape[:2]))
+#
+# An array from get() is only valid until the same name is asked for again.
+# To keep one across frames (the previous gray frame), swap() it with another
+# name. Named buffers belong to the processing thread.
+#
+# Captured frames travel through the pipeline queues, so they are handed out
+# and returned explicitly instead: acquire() gives a free frame (or None before
+# the first one exists), adopt() registers a frame the capture allocated, and
+# release() returns it once nothing holds it anymore. These are thread safe.
+
+import threading
+
+import numpy as np
+
+
+class BufferPool:
+    def __init__(self):
+        self.buffers = {}       # name -> array
+        self.frames = {}        # id -> every frame owned by the pool
+        self.free_frames = []
+        self.frame_lock = threading.Lock()
+
+    def get(self, name, shape, dtype=np.uint8):
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self.buffers[name] = np.empty(shape, dtype)
+        return buf
+
+    def zeros(self, name, shape, dtype=np.uint8):
+        buf = self.get(name, shape, dtype)
+        buf.fill(0)
+        return buf
+
+    def swap(self, a, b):
+        # e.g. swap("gray", "prev_gray") after keeping this frame's gray: the
+        # next get("gray") reuses the old previous frame
+        self.buffers[a], self.buffers[b] = self.buffers.get(b), self.buffers.get(a)
+
+    def acquire(self):
+        with self.frame_lock:
+            return self.free_frames.pop() if self.free_frames else None
+
+    def adopt(self, frame):
+        with self.frame_lock:
+            if id(frame) not in self.frames:
+                # A new size makes the old frames useless, let them go
+                if self.frames and next(iter(self.frames.values())).shape != frame.shape:
+                    self.frames.clear()
+                    self.free_frames.clear()
+                self.frames[id(frame)] = frame
+        return frame
+
+    def release(self, frame):
+        # Anything not from the pool (a feature's own output buffer) is ignored
+        if frame is None:
+            return
+        with self.frame_lock:
+            if self.frames.get(id(frame)) is frame and not any(f is frame for f in self.free_frames):
+                self.free_frames.append(frame)
+
+    def memory_bytes(self):
+        with self.frame_lock:
+            frames = list(self.frames.values())
+        return sum(b.nbytes for b in self.buffers.values() if b is not None) + sum(f.nbytes for f in frames)
+
+    def clear(self):
+        self.buffers.clear()
+        with self.frame_lock:
+            self.frames.clear()
+            self.free_frames.clear()
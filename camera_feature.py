@@ -0,0 +1,292 @@
+# Common camera handling for all the features.
+# A feature only implements process_frame(frame) -> output image (or None to
+# skip the frame) and, if it keeps per-stream state, reset(). While a frame is
+# processed, self.frame_id holds its frame bus id. Reading from the shared
+# camera (or the frame source passed to start_camera), processing and JPEG
+# encoding then run as one FramePipeline per feature, and every viewer of the
+# feature reads from the same broadcaster. Small JSON events for WebSocket
+# viewers go out through self.events (see emit()). When every viewer only
+# takes events (client-side rendering), self.render is False: features then
+# skip their overlays and no frame is encoded at all.
+# Models and OS backends are loaded in load(), on the first frame rather than
+# at construction; if that fails the feature shows the error in its stream
+# and the other features are unaffected.
+# Features that follow a landmark (cursor, fingertip, pinch distance) smooth it
+# with self.smoother, a smoothing.MotionFilter picked by the smoothing spec.
+# Per-frame arrays (conversions, masks, the captured frames themselves) come
+# from self.buffers, the pipeline's BufferPool, and are reused frame to frame.
+# wCam/hCam follow the size the camera actually delivers. Models run on a copy
+# at most inference_width wide (inference_frame()), results are scaled back.
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import frame_bus
+import metrics
+import scheduler
+import smoothing
+from buffers import BufferPool
+from encoder import FrameEncoder
+from pipeline import EventBroadcaster, FrameBroadcaster, FramePipeline
+
+
+class CameraFeature:
+    name = "camera"  # used in routes and metrics
+    jpeg_quality = 80  # stream settings, lowered on the fly for lagging viewers
+    stream_scale = 1.0
+    # Skip encoding frames whose 32x24 thumbnail changed by no more than this
+    # many levels, 0 for off. Off by default: a fingertip, landmark or small
+    # overlay moving barely changes the thumbnail.
+    dedup_threshold = 0
+    mirrored = False   # True when process_frame flips the image horizontally
+    shared = False     # True when the feature has no per-client state (see sessions)
+    smoothing = None   # spec for smoothing.make_filter, None when nothing is tracked
+    display_lead = 0.0  # seconds from processing until the result takes effect
+    inference_width = 640  # widest frame the models see, None for full size
+
+    def __init__(self):
+        self.metrics = metrics.get_metrics(self.name)  # shared by all instances of the feature
+        self.rate = metrics.FrameRate()  # this instance's frames, for its own overlays
+        self.cap = None
+        self.pipeline = None
+        self.broadcaster = FrameBroadcaster()
+        self.events = EventBroadcaster()
+        self.gesture = None  # last state sent with set_gesture()
+        self.encoder = FrameEncoder(self.jpeg_quality, self.stream_scale,
+                                    dedup_threshold=self.dedup_threshold)
+        self.buffers = BufferPool()
+        self.streaming = False
+        self.viewers = 0
+        self.video_viewers = 0  # viewers that want encoded frames
+        self.render = True      # whether this frame's overlays are needed
+        self.source = 0
+        self.wCam, self.hCam = 640, 480  # updated from every frame
+        self.frame_id = None   # bus id of the frame being processed
+        self.frame_time = 0.0  # capture time of that frame
+        self.camera_lock = threading.RLock()
+        self.loaded = False
+        self.error = None      # why load() failed, the feature is disabled then
+        self.load_lock = threading.Lock()
+        self.smoother = smoothing.make_filter(self.smoothing) if self.smoothing else None
+
+    def set_source(self, source):
+        # Camera index, video file, image directory, "synthetic" or a source
+        # object, see frame_sources. Takes effect on the next start_camera().
+        self.source = source
+        detector = getattr(self, "detector", None)
+        if detector is not None:
+            detector.source = source
+
+    def start_camera(self, source=None):
+        with self.camera_lock:
+            if source is not None and source != self.source:
+                self.stop_camera()
+                self.set_source(source)
+            if not self.cap or not self.cap.isOpened():
+                if self.cap:
+                    self.cap.release()
+                self.cap = frame_bus.open_camera(self.source)
+            if self.pipeline and self.pipeline.failed:
+                scheduler.detach(self.pipeline)
+                self.pipeline.stop()
+                self.pipeline = None
+            if not self.pipeline or not self.pipeline.running:
+                self.pipeline = FramePipeline(self.cap, self._process, self.broadcaster, self.metrics,
+                                              encoder=self.encoder, pool=self.buffers,
+                                              lost_frame=self.source_lost_frame)
+                self.pipeline.start()
+                scheduler.attach(self.pipeline, self.source)
+            self.streaming = True
+
+    def stop_camera(self):
+        with self.camera_lock:
+            self.streaming = False
+            if self.pipeline:
+                scheduler.detach(self.pipeline)
+                self.pipeline.stop()
+                self.pipeline = None
+            if self.cap:
+                self.cap.release()
+                self.cap = None
+            self.broadcaster.clear()
+            self.encoder.reset()
+            self.gesture = None
+            self.buffers.clear()
+            if self.smoother:
+                self.smoother.reset()
+            self.reset()
+
+    def reset(self):
+        pass
+
+    def set_smoothing(self, spec):
+        # Raises ValueError/TypeError for an unknown filter or parameter
+        self.smoother = smoothing.make_filter(spec)
+
+    def inference_scale(self, frame):
+        # Factor from display to inference coordinates
+        w = frame.shape[1]
+        return self.inference_width / w if self.inference_width and w > self.inference_width else 1.0
+
+    def inference_frame(self, frame):
+        # The frame downscaled for the models (into a pooled buffer) and the
+        # factor from display to inference coordinates
+        scale = self.inference_scale(frame)
+        if scale == 1.0:
+            return frame, scale
+        h, w = frame.shape[:2]
+        size = (round(w * scale), round(h * scale))
+        small = cv2.resize(frame, size, dst=self.buffers.get("inference", (size[1], size[0]) + frame.shape[2:]),
+                           interpolation=cv2.INTER_AREA)
+        return small, scale
+
+    def display_time(self):
+        # When the result of the current frame will be seen, the time to
+        # extrapolate tracked positions to
+        return time.perf_counter() + self.display_lead
+
+    def memory_bytes(self):
+        # Rough size of the per-stream state: numpy arrays held directly and
+        # anything else that can report its own size
+        total = 0
+        for value in vars(self).values():
+            if isinstance(value, np.ndarray):
+                total += value.nbytes
+            elif hasattr(value, "memory_bytes"):
+                total += value.memory_bytes()
+        return total
+
+    def process_frame(self, frame):
+        raise NotImplementedError
+
+    def load(self):
+        # Load models and OS backends, preferably through the models cache.
+        # Hand features get their shared MediaPipe graph here.
+        detector = getattr(self, "detector", None)
+        if detector is not None:
+            detector.service()
+
+    def ensure_loaded(self):
+        with self.load_lock:
+            if not self.loaded and self.error is None:
+                try:
+                    # Threads the models start must not inherit a pinned
+                    # pipeline thread's cores, see scheduler
+                    with scheduler.unpinned():
+                        self.load()
+                    self.loaded = True
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    print(f"{self.name} disabled: {self.error}")
+        return self.error is None
+
+    def warm_up(self):
+        # Load everything and run one blank frame, so the first viewer does
+        # not wait for model initialization
+        if self.ensure_loaded():
+            self._process(None, time.perf_counter(), np.zeros((self.hCam, self.wCam, 3), dtype=np.uint8))
+            self.reset()
+
+    def error_frame(self, frame):
+        frame //= 3
+        cv2.putText(frame, f"{self.name} unavailable", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        cv2.putText(frame, self.error[:70], (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        return frame
+
+    def source_lost_frame(self):
+        # Last frame of a stream whose source cannot be read
+        frame = np.zeros((self.hCam, self.wCam, 3), dtype=np.uint8)
+        cv2.putText(frame, f"{self.name} unavailable", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        cv2.putText(frame, f"no frames from source {self.source}"[:70], (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (255, 255, 255), 1)
+        return frame
+
+    def _process(self, frame_id, timestamp, frame):
+        self.frame_id, self.frame_time = frame_id, timestamp
+        self.hCam, self.wCam = frame.shape[:2]
+        self.render = self.video_viewers > 0 or self.viewers == 0
+        if not self.ensure_loaded():
+            return self.error_frame(frame) if self.render else None
+        with self.metrics.frame(self.rate):
+            result = self.process_frame(frame)
+        if self.events.listeners:
+            self.emit_landmarks()
+        return result if self.render else None
+
+    def emit(self, kind, **data):
+        # Publish a JSON event for WebSocket viewers, skipped when nobody listens
+        if self.events.listeners:
+            self.events.publish({"type": kind, "feature": self.name, "frame": self.frame_id,
+                                 "t": round(self.frame_time, 4), **data})
+
+    def emit_landmarks(self):
+        # Hand features publish the normalized x, y of every landmark per
+        # frame, in the orientation of the streamed image
+        detector = getattr(self, "detector", None)
+        results = getattr(detector, "results", None)
+        if results is None:
+            return
+        hands = results.landmarks[..., :2].round(4)
+        if self.mirrored:
+            hands[..., 0] = 1 - hands[..., 0]
+        self.emit("landmarks", hands=hands.tolist())
+
+    def initial_events(self):
+        # Sent to every new event listener before the live events
+        return [{"type": "config", "feature": self.name, "mirrored": self.mirrored,
+                 "size": [self.wCam, self.hCam]}]
+
+    def set_gesture(self, state, **data):
+        # Edge triggered: only a change of state (or of its data) becomes an event
+        gesture = (state, data)
+        if gesture != self.gesture:
+            self.gesture = gesture
+            self.emit("gesture", state=state, **data)
+
+    def add_viewer(self, video=True):
+        self.start_camera()
+        with self.camera_lock:
+            self.viewers += 1
+            if video:
+                self.video_viewers += 1
+
+    def remove_viewer(self, video=True):
+        # The camera keeps running until the last viewer has gone
+        with self.camera_lock:
+            self.viewers -= 1
+            if video:
+                self.video_viewers -= 1
+            if self.viewers == 0:
+                self.stop_camera()
+
+    def viewer_failed(self):
+        pipeline = self.pipeline
+        return not self.streaming or (pipeline is not None and pipeline.failed)
+
+    def record_delivery(self, last_seq, seq):
+        # All viewers share one encoder, so the slowest one sets the quality
+        if last_seq and seq > last_seq + 1:
+            self.metrics.count("skipped_viewer", seq - last_seq - 1)
+            self.encoder.report_lag(seq - last_seq - 1)
+        else:
+            self.encoder.report_on_time()
+
+    def generate(self):
+        self.add_viewer()
+        last_seq = 0
+        try:
+            while not self.viewer_failed():
+                seq, chunk = self.broadcaster.wait_next(last_seq)
+                if chunk is None:
+                    continue
+                self.record_delivery(last_seq, seq)
+                last_seq = seq
+                start = time.perf_counter()
+                yield chunk
+                self.metrics.record("send", time.perf_counter() - start)
+                self.metrics.count("sent")
+        finally:
+            self.remove_viewer()
@@ -0,0 +1,122 @@
+# JPEG encoding for the MJPEG streams.
+# Each feature has its own quality and output scale. When viewers start
+# skipping frames the encoder lowers the quality step by step (and below the
+# quality floor, the scale), then slowly climbs back once they keep up again.
+# When deduplication is on, frames that look the same as the last one sent are
+# not encoded at all.
+
+import threading
+import time
+
+import cv2
+
+from buffers import BufferPool
+
+THUMB_SIZE = (32, 24)
+
+
+def multipart_chunk(jpeg, content_length=True):
+    # One copy of the encoder's buffer into the final chunk, no tobytes() and
+    # no concatenation chain. Every viewer shares the resulting bytes.
+    if content_length:
+        header = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(jpeg)
+    else:
+        header = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+    return b''.join((header, jpeg, b'\r\n'))
+
+
+def jpeg_payload(chunk):
+    # The JPEG inside a multipart chunk as a view, for transports without
+    # multipart framing (WebSocket)
+    start = chunk.index(b'\r\n\r\n') + 4
+    return memoryview(chunk)[start:-2]
+
+
+class FrameEncoder:
+    def __init__(self, quality=80, scale=1.0, min_quality=40, min_scale=0.5,
+                 dedup_threshold=0, keyframe_interval=2.0):
+        self.target_quality = quality
+        self.target_scale = scale
+        self.min_quality = min_quality
+        self.min_scale = min_scale
+        self.quality = quality
+        self.scale = scale
+        # A frame is a duplicate when no cell of a 32x24 thumbnail changed by
+        # more than dedup_threshold levels; 0 turns deduplication off. An
+        # unchanged frame is still re-sent every keyframe_interval seconds.
+        self.dedup_threshold = dedup_threshold
+        self.keyframe_interval = keyframe_interval
+        self.last_thumb = None
+        self.last_sent = 0.0
+        self.on_time = 0
+        self.buffers = BufferPool()  # downscaled frames, encode thread only
+        self.lock = threading.Lock()
+
+    def configure(self, quality=None, scale=None):
+        with self.lock:
+            if quality is not None:
+                self.target_quality = self.quality = int(min(max(quality, self.min_quality), 100))
+            if scale is not None:
+                self.target_scale = self.scale = float(min(max(scale, 0.1), 1.0))
+            self.last_thumb = None
+
+    def report_lag(self, skipped):
+        # A viewer skipped frames: it cannot keep up with the current size
+        with self.lock:
+            self.on_time = 0
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 5 * min(skipped, 4))
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, round(self.scale - 0.1, 2))
+
+    def report_on_time(self):
+        # Climb back after a run of frames delivered without skipping
+        with self.lock:
+            self.on_time += 1
+            if self.on_time < 30:
+                return
+            self.on_time = 0
+            if self.scale < self.target_scale:
+                self.scale = min(self.target_scale, round(self.scale + 0.1, 2))
+            elif self.quality < self.target_quality:
+                self.quality = min(self.target_quality, self.quality + 5)
+
+    def is_duplicate(self, frame):
+        if not self.dedup_threshold:
+            return False
+        thumb = cv2.resize(frame, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        now = time.perf_counter()
+        if (self.last_thumb is not None and thumb.shape == self.last_thumb.shape and
+                now - self.last_sent < self.keyframe_interval and
+                cv2.absdiff(thumb, self.last_thumb).max() <= self.dedup_threshold):
+            return True
+        self.last_thumb = thumb
+        self.last_sent = now
+        return False
+
+    def encode(self, frame):
+        # Returns the multipart chunk, or None when the frame is a duplicate
+        if self.is_duplicate(frame):
+            return None
+        with self.lock:
+            quality, scale = self.quality, self.scale
+        if scale < 1.0:
+            h, w = frame.shape[:2]
+            size = (round(w * scale), round(h * scale))
+            frame = cv2.resize(frame, size, dst=self.buffers.get("scaled", (size[1], size[0]) + frame.shape[2:]),
+                               interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, (cv2.IMWRITE_JPEG_QUALITY, quality))
+        if not ret:
+            return None
+        return multipart_chunk(buffer)
+
+    def reset(self):
+        with self.lock:
+            self.quality, self.scale = self.target_quality, self.target_scale
+            self.last_thumb = None
+            self.on_time = 0
+
+    def state(self):
+        with self.lock:
+            return {"quality": self.quality, "scale": self.scale,
+                    "target_quality": self.target_quality, "target_scale": self.target_scale}
@@ -1,55 +1,228 @@
+import os
+
 import cv2
+import numpy as np
+import models
+from camera_feature import CameraFeature
+from parallel_detect import TiledFaceDetector
+
+
+class FaceTrack:
+    # One face between detections: its box, a few corners inside it for
+    # optical flow, and the eyes found the last time the box was checked
+    def __init__(self, box):
+        self.box = np.asarray(box, dtype=np.float32)  # x, y, w, h
+        self.points = None
+        self.eyes = []          # eye boxes relative to the face box
+        self.eye_box = None     # face box the eyes were detected in
+
+    def iou(self, box):
+        x, y, w, h = self.box
+        bx, by, bw, bh = box
+        iw = max(0.0, min(x + w, bx + bw) - max(x, bx))
+        ih = max(0.0, min(y + h, by + bh) - max(y, by))
+        inter = iw * ih
+        return inter / (w * h + bw * bh - inter) if inter else 0.0
+
+    def eyes_stale(self, threshold):
+        # True when the box moved or resized by more than threshold of its size
+        if self.eye_box is None:
+            return True
+        x, y, w, h = self.box
+        ex, ey, ew, eh = self.eye_box
+        return (abs(x - ex) > threshold * ew or abs(y - ey) > threshold * eh or
+                abs(w - ew) > threshold * ew or abs(h - eh) > threshold * eh)
+
+
+class FaceDetection(CameraFeature):
+    name = "face"
+    shared = True  # same output for every client
+    jpeg_quality = 70
 
-class FaceDetection:
     def __init__(self):
-        self.cap = None
-        self.streaming = False
-        self.wCam, self.hCam = 640, 480
-        # Loading Haar cascades for face and eye detection
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-
-    def start_camera(self):
-        if not self.cap or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(0)
-        self.streaming = True
-
-    def stop_camera(self):
-        self.streaming = False
-        if self.cap:
-            self.cap.release()
-            self.cap = None
-
-    def generate(self):
-        self.start_camera()
-        while self.streaming:
-            ret, frame = self.cap.read()
-            if not ret:
-                continue
+        super().__init__()
+        # Haar cascades for face and eye detection, loaded on the first frame
+        self.face_cascade = None
+        self.eye_cascade = None
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Tracking mode: faces are detected on a downscaled frame every
+        # detect_interval frames and followed with optical flow in between,
+        # eyes are only searched again when a face box moved noticeably
+        self.tracking = True
+        self.detect_interval = 5
+        self.detect_scale = 0.5
+        self.eye_threshold = 0.1
+        self.tracks = []
+        self.prev_gray = None
+        self.frame_count = 0
 
-            # Detecting faces
-            faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+        # Optional process pool searching overlapping tiles of each frame,
+        # see set_workers(); worth it on many cores and large frames.
+        # GESTUREFUSION_FACE_WORKERS=4 starts one with the feature.
+        self.workers = int(os.environ.get("GESTUREFUSION_FACE_WORKERS", "0"))
+        self.pending_workers = None
+        self.parallel = None
+
+    def load(self):
+        self.face_cascade = models.haar_cascade('haarcascade_frontalface_default.xml', self.source)
+        self.eye_cascade = models.haar_cascade('haarcascade_eye.xml', self.source)
+        if self.workers and not self.parallel:
+            self.apply_workers(self.workers)
+
+    def set_workers(self, workers):
+        # Picked up by the processing thread before its next frame, so the pool
+        # is never swapped out under a running detection
+        self.pending_workers = workers
+
+    def apply_workers(self, workers):
+        # With workers the tiles are searched at the full capture size, which
+        # is what the pool is for; without, frames are capped at inference_width
+        if self.parallel:
+            self.parallel.close()
+            self.parallel = None
+        self.workers = workers
+        if workers > 0:
+            self.parallel = TiledFaceDetector(workers)
+            self.inference_width = None
+        else:
+            self.__dict__.pop("inference_width", None)
+
+    def find_faces(self, gray):
+        if self.parallel:
+            return [box for box, _ in self.parallel.detect(gray, find_eyes=False)]
+        return self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+    def reset(self):
+        self.tracks = []
+        self.prev_gray = None
+        self.frame_count = 0
+
+    def process_frame(self, frame):
+        if self.pending_workers is not None:
+            workers, self.pending_workers = self.pending_workers, None
+            self.apply_workers(workers)
+
+        # Detection and tracking run on the inference-size gray image, boxes
+        # are scaled back to the frame for drawing
+        small, scale = self.inference_frame(frame)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self.buffers.get("gray", small.shape[:2]))
+        if self.prev_gray is not None and self.prev_gray.shape != gray.shape:
+            # New capture or inference size: tracks and the previous frame no longer fit
+            self.reset()
 
-            for (x, y, w, h) in faces:
-                # Drawing rectangle around face
+        if not self.tracking:
+            return self.detect_full(frame, gray, scale)
+
+        with self.metrics.timer("inference"):
+            if self.prev_gray is None or not self.tracks or self.frame_count % self.detect_interval == 0:
+                self.detect_faces(gray)
+            else:
+                self.track_faces(gray)
+        self.prev_gray = gray
+        self.buffers.swap("gray", "prev_gray")  # the next frame converts into the old one
+        self.frame_count += 1
+
+        for track in self.tracks:
+            if track.eyes_stale(self.eye_threshold):
+                x, y, w, h = track.box.astype(int)
+                roi_gray = gray[max(y, 0):y + h, max(x, 0):x + w]
+                with self.metrics.timer("inference"):
+                    track.eyes = self.eye_cascade.detectMultiScale(roi_gray, scaleFactor=1.1, minNeighbors=10) if roi_gray.size else []
+                track.eye_box = track.box.copy()
+
+            # Drawing rectangle around face and the eyes inside it, eye boxes
+            # are relative to eye_box in inference pixels
+            x, y, w, h = (track.box / scale).astype(int)
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            sx, sy = w / track.eye_box[2], h / track.eye_box[3]
+            for (ex, ey, ew, eh) in track.eyes:
+                p1 = (x + int(ex * sx), y + int(ey * sy))
+                cv2.rectangle(frame, p1, (p1[0] + int(ew * sx), p1[1] + int(eh * sy)), (255, 0, 0), 2)
+
+        return frame
+
+    def detect_faces(self, gray):
+        h, w = gray.shape
+        size = (round(w * self.detect_scale), round(h * self.detect_scale))
+        small = cv2.resize(gray, size, dst=self.buffers.get("small", (size[1], size[0])), interpolation=cv2.INTER_AREA)
+        faces = self.find_faces(small)
+
+        tracks = []
+        for box in faces:
+            box = np.asarray(box, dtype=np.float32) / self.detect_scale
+            # Keep the eye cache of the track this face continues, if any
+            best = max(self.tracks, key=lambda t: t.iou(box), default=None)
+            if best is not None and best.iou(box) > 0.3 and best not in tracks:
+                best.box = box
+                track = best
+            else:
+                track = FaceTrack(box)
+            track.points = self.box_points(gray, track.box)
+            tracks.append(track)
+        self.tracks = tracks
+
+    def box_points(self, gray, box):
+        x, y, w, h = box.astype(int)
+        mask = self.buffers.zeros("points_mask", gray.shape)
+        mask[max(y, 0):y + h, max(x, 0):x + w] = 255
+        return cv2.goodFeaturesToTrack(gray, 30, 0.01, 5, mask=mask)
+
+    def track_faces(self, gray):
+        # Move and scale every box with the median motion of its corners
+        tracks = []
+        for track in self.tracks:
+            if track.points is None or len(track.points) < 3:
+                continue
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, track.points, None)
+            ok = status.ravel() == 1
+            if ok.sum() < 3:
+                continue
+            old, new = track.points.reshape(-1, 2)[ok], new_points.reshape(-1, 2)[ok]
+            dx, dy = np.median(new - old, axis=0)
+            old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1).mean()
+            new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1).mean()
+            scale = new_spread / old_spread if old_spread > 0 else 1.0
+
+            x, y, w, h = track.box
+            cx, cy = x + w / 2 + dx, y + h / 2 + dy
+            w, h = w * scale, h * scale
+            track.box = np.array([cx - w / 2, cy - h / 2, w, h], dtype=np.float32)
+            track.points = new.reshape(-1, 1, 2)
+            tracks.append(track)
+        self.tracks = tracks
+
+    def detect_full(self, frame, gray, scale=1.0):
+        if self.parallel:
+            with self.metrics.timer("inference"):
+                found = self.parallel.detect(gray)
+            for face, eyes in found:
+                x, y, w, h = (int(v / scale) for v in face)
                 cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                for eye in eyes:
+                    ex, ey, ew, eh = (int(v / scale) for v in eye)
+                    cv2.rectangle(frame, (x + ex, y + ey), (x + ex + ew, y + ey + eh), (255, 0, 0), 2)
+            return frame
 
-                # Geting the face region of interest for eye detection
-                roi_gray = gray[y:y + h, x:x + w]
-                roi_color = frame[y:y + h, x:x + w]
+        # Detecting faces
+        with self.metrics.timer("inference"):
+            faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+        for (x, y, w, h) in faces:
+            # Geting the face region of interest for eye detection
+            roi_gray = gray[y:y + h, x:x + w]
 
-                # Detecting eyes within face region
+            # Detecting eyes within face region
+            with self.metrics.timer("inference"):
                 eyes = self.eye_cascade.detectMultiScale(roi_gray, scaleFactor=1.1, minNeighbors=10)
 
-                for (ex, ey, ew, eh) in eyes:
-                    # Drawing rectangle around eyes inside the face region
-                    cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (255, 0, 0), 2)
+            # Drawing rectangle around face, back in frame coordinates
+            x, y, w, h = (int(v / scale) for v in (x, y, w, h))
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            roi_color = frame[y:y + h, x:x + w]
 
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                continue
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+            for eye in eyes:
+                # Drawing rectangle around eyes inside the face region
+                ex, ey, ew, eh = (int(v / scale) for v in eye)
+                cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (255, 0, 0), 2)
 
-        self.stop_camera()
+        return frame
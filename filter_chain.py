@@ -0,0 +1,205 @@
+# Composable filter chains for FilterCamera.
+# A chain is a list of steps registered under a name. When a chain is compiled,
+# neighbouring point-wise steps (tone curves, gamma, contrast, invert) are
+# folded into a single lookup table, blur kernels are built once, and every
+# step writes into buffers that are reused from frame to frame. The last step
+# writes back into the input frame, so the result belongs to whoever owns that
+# frame (the pipeline's BufferPool) and is released with it after encoding.
+
+import cv2
+import numpy as np
+
+
+def _identity_lut():
+    return np.repeat(np.arange(256, dtype=np.uint8).reshape(256, 1, 1), 3, axis=2)
+
+
+class PointStep:
+    # A per-pixel step described by a (256, 1, 3) uint8 table, one column per BGR channel
+    def lut(self):
+        raise NotImplementedError
+
+
+class Lut(PointStep):
+    def __init__(self, table):
+        table = np.asarray(table, dtype=np.uint8)
+        if table.ndim == 1:
+            table = np.repeat(table.reshape(256, 1, 1), 3, axis=2)
+        self.table = table.reshape(256, 1, 3)
+
+    def lut(self):
+        return self.table
+
+
+class ToneCurve(PointStep):
+    # Piecewise linear curve through (input, output) points, per channel if
+    # given as a dict {"b": [...], "g": [...], "r": [...]}
+    def __init__(self, points):
+        self.points = points
+
+    def lut(self):
+        x = np.arange(256)
+        curves = self.points if isinstance(self.points, dict) else {c: self.points for c in "bgr"}
+        table = _identity_lut()
+        for i, c in enumerate("bgr"):
+            if c in curves:
+                px, py = zip(*curves[c])
+                table[:, 0, i] = np.clip(np.interp(x, px, py), 0, 255).astype(np.uint8)
+        return table
+
+
+class Gamma(PointStep):
+    def __init__(self, gamma):
+        self.gamma = gamma
+
+    def lut(self):
+        table = 255.0 * (np.arange(256) / 255.0) ** (1.0 / self.gamma)
+        return Lut(np.clip(table, 0, 255)).lut()
+
+
+class BrightnessContrast(PointStep):
+    def __init__(self, alpha=1.0, beta=0.0):
+        self.alpha, self.beta = alpha, beta
+
+    def lut(self):
+        return Lut(np.clip(np.arange(256) * self.alpha + self.beta, 0, 255)).lut()
+
+
+class Invert(PointStep):
+    def lut(self):
+        return Lut(255 - np.arange(256)).lut()
+
+
+class Gray:
+    # Gray as a 3x3 color transform, so the output stays 3 channel BGR
+    matrix = np.tile(np.array([[0.114, 0.587, 0.299]], dtype=np.float32), (3, 1))
+
+    def apply(self, src, dst):
+        return cv2.transform(src, self.matrix, dst=dst)
+
+
+class GaussianBlur:
+    def __init__(self, ksize=15, sigma=0):
+        self.kernel = cv2.getGaussianKernel(ksize, sigma)  # separable, built once
+
+    def apply(self, src, dst):
+        return cv2.sepFilter2D(src, -1, self.kernel, self.kernel, dst=dst)
+
+
+class Sharpen:
+    def __init__(self, kernel=None):
+        if kernel is None:
+            kernel = np.array([[-1, -1, -1],
+                               [-1,  9, -1],
+                               [-1, -1, -1]])
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+
+    def apply(self, src, dst):
+        return cv2.filter2D(src, -1, self.kernel, dst=dst)
+
+
+class Edges:
+    def __init__(self, low=50, high=150):
+        self.low, self.high = low, high
+        self.gray = None
+        self.edges = None
+
+    def apply(self, src, dst):
+        self.gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        self.edges = cv2.Canny(self.gray, self.low, self.high, edges=self.edges)
+        return cv2.cvtColor(self.edges, cv2.COLOR_GRAY2BGR, dst=dst)
+
+
+class _FusedLut:
+    def __init__(self, table):
+        self.table = table
+
+    def apply(self, src, dst):
+        return cv2.LUT(src, self.table, dst=dst)
+
+
+class FilterChain:
+    def __init__(self, steps):
+        self.steps = self.compile(steps)
+        self.buffers = [None] * len(self.steps)
+
+    @staticmethod
+    def compile(steps):
+        compiled = []
+        table = None
+        for step in steps:
+            if isinstance(step, PointStep):
+                lut = step.lut()
+                if table is None:
+                    table = lut
+                else:
+                    # Fold into the previous table: new[v] = lut[table[v]] per channel
+                    table = np.stack([lut[table[:, 0, c], 0, c] for c in range(3)], axis=-1).reshape(256, 1, 3)
+                continue
+            if table is not None:
+                compiled.append(_FusedLut(table))
+                table = None
+            compiled.append(step)
+        if table is not None:
+            compiled.append(_FusedLut(table))
+        return compiled
+
+    def apply(self, frame):
+        if not self.steps:
+            return frame
+        img = frame
+        last = len(self.steps) - 1
+        for i, step in enumerate(self.steps):
+            if i == last and img.shape == frame.shape and img.dtype == frame.dtype:
+                # The last step writes into the input frame, so a single-step
+                # chain runs fully in place; every step supports that
+                img = step.apply(img, frame)
+            else:
+                dst = self._buffer(self.buffers, i, img)
+                img = self.buffers[i] = step.apply(img, dst)
+        return img
+
+    def memory_bytes(self):
+        return sum(b.nbytes for b in self.buffers if b is not None)
+
+    @staticmethod
+    def _buffer(buffers, i, like):
+        buf = buffers[i]
+        if buf is None or buf.shape != like.shape or buf.dtype != like.dtype:
+            buf = buffers[i] = np.empty_like(like)
+        return buf
+
+
+FILTERS = {}
+
+
+def register_filter(name, steps):
+    # steps is a list of step objects, or a function returning a fresh list
+    FILTERS[name] = steps
+
+
+def build_chain(mode):
+    # mode is a registered name or several joined with "+", e.g. "blur+sharpen+warm"
+    steps = []
+    for name in mode.split("+"):
+        entry = FILTERS.get(name.strip())
+        if entry is None:
+            continue
+        steps.extend(entry() if callable(entry) else entry)
+    return FilterChain(steps)
+
+
+register_filter("original", [])
+register_filter("gray", lambda: [Gray()])
+register_filter("blur", lambda: [GaussianBlur(15)])
+register_filter("edges", lambda: [Edges(50, 150)])
+register_filter("sharpen", lambda: [Sharpen()])
+register_filter("invert", lambda: [Invert()])
+register_filter("warm", lambda: [ToneCurve({"b": [(0, 0), (128, 110), (255, 230)],
+                                            "r": [(0, 10), (128, 150), (255, 255)]})])
+register_filter("vintage", lambda: [GaussianBlur(3),
+                                    BrightnessContrast(0.9, 20),
+                                    ToneCurve({"b": [(0, 30), (255, 210)],
+                                               "g": [(0, 10), (255, 240)],
+                                               "r": [(0, 20), (255, 255)]}),
+                                    Gamma(1.1)])
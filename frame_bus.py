@@ -0,0 +1,188 @@
+# Shares one camera between all the features.
+# A single capture thread owns the capture (a webcam, or any frame source from
+# frame_sources: video file, image directory, synthetic pattern) and decodes every frame once
+# into a small ring of reusable buffers. Features subscribe to the bus instead of
+# opening the device themselves: the device is opened for the first subscriber
+# and released when the last one leaves.
+# Cameras are asked for the mode in capture (frame_sources.DEFAULT_CAPTURE,
+# GESTUREFUSION_CAPTURE=1280x720@30 or configure()), and what they actually
+# deliver is checked and reported in status().
+
+import os
+import threading
+import time
+
+import numpy as np
+
+import frame_sources
+
+CAPTURE = dict(frame_sources.DEFAULT_CAPTURE,
+               **frame_sources.parse_capture(os.environ.get("GESTUREFUSION_CAPTURE", "")))
+
+
+class FrameBus:
+    def __init__(self, source=0, ring_size=4):
+        self.source = source
+        self.capture = dict(CAPTURE)  # requested camera mode, used when the device opens
+        self.capture_info = None      # requested vs actual, see frame_sources.configure_capture
+        self.ring_size = ring_size
+        self.ring = [None] * ring_size  # decoded frames, reused round robin
+        self.frame_id = 0               # id of the newest frame in the ring
+        self.timestamps = [0.0] * ring_size
+        self.subscribers = 0
+        self.running = False
+        self.thread = None
+
+        # state_lock guards opening/closing, frame_lock guards the ring
+        self.state_lock = threading.Lock()
+        self.frame_lock = threading.Lock()
+        self.new_frame = threading.Condition(self.frame_lock)
+
+    def subscribe(self):
+        with self.state_lock:
+            self.subscribers += 1
+            if not self.running:
+                self._stop()  # reap a capture thread that died on its own
+                self._start()
+        return FrameSubscription(self)
+
+    def unsubscribe(self):
+        with self.state_lock:
+            if self.subscribers == 0:
+                return
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self._stop()
+
+    def _start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        self.running = False
+        with self.new_frame:
+            self.new_frame.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _capture_loop(self):
+        cap = frame_sources.open_source(self.source)
+        checked = True
+        if isinstance(self.source, int):
+            self.capture_info = frame_sources.configure_capture(cap, **self.capture)
+            checked = False
+        while self.running:
+            # Decode straight into the oldest slot, readers only copy the newest one
+            slot = (self.frame_id + 1) % self.ring_size
+            success, frame = cap.read(self.ring[slot])
+            if not success:
+                if not cap.isOpened():
+                    break
+                continue
+            if not checked:
+                self._check_frame(frame)
+                checked = True
+            with self.new_frame:
+                self.ring[slot] = frame
+                self.timestamps[slot] = time.perf_counter()
+                self.frame_id += 1
+                self.new_frame.notify_all()
+        cap.release()
+        self.running = False
+        with self.new_frame:
+            self.new_frame.notify_all()
+
+    def _check_frame(self, frame):
+        # The first frame is the final word on the size, some backends report
+        # the requested size whatever they deliver
+        info = self.capture_info
+        h, w = frame.shape[:2]
+        info["actual"]["width"], info["actual"]["height"] = w, h
+        for name, value in (("width", w), ("height", h)):
+            if info["requested"].get(name, value) != value and name not in info["mismatched"]:
+                info["mismatched"].append(name)
+        if info["mismatched"]:
+            wanted = {k: info["requested"][k] for k in info["mismatched"]}
+            got = {k: info["actual"][k] for k in info["mismatched"]}
+            print(f"camera {self.source}: asked for {wanted}, got {got}")
+
+    def status(self):
+        with self.frame_lock:
+            newest = self.timestamps[self.frame_id % self.ring_size]
+            oldest = self.timestamps[(self.frame_id + 1) % self.ring_size]
+            frames = self.frame_id
+        fps = (self.ring_size - 1) / (newest - oldest) if frames >= self.ring_size and newest > oldest else 0.0
+        return {"running": self.running, "subscribers": self.subscribers, "frames": frames,
+                "fps": round(fps, 1), **(self.capture_info or {})}
+
+    def read_after(self, last_id, image=None, timeout=1.0):
+        # Wait for a frame newer than last_id and copy it out of the ring
+        with self.new_frame:
+            if not self.new_frame.wait_for(
+                    lambda: self.frame_id > last_id or not self.running, timeout):
+                return last_id, 0.0, None
+            if self.frame_id <= last_id:
+                return last_id, 0.0, None
+            slot = self.frame_id % self.ring_size
+            frame = self.ring[slot]
+            if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+                np.copyto(image, frame)
+            else:
+                image = frame.copy()
+            return self.frame_id, self.timestamps[slot], image
+
+
+class FrameSubscription:
+    # Mimics the parts of cv2.VideoCapture the features use (read, isOpened, release)
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.frame_id = bus.frame_id  # only frames decoded after subscribing
+        self.timestamp = 0.0
+        self.active = True
+
+    def isOpened(self):
+        return self.active and self.bus.running
+
+    def read(self, image=None):
+        if not self.active:
+            return False, None
+        frame_id, timestamp, frame = self.bus.read_after(self.frame_id, image)
+        if frame is None:
+            return False, None
+        self.frame_id, self.timestamp = frame_id, timestamp
+        return True, frame
+
+    def release(self):
+        if self.active:
+            self.active = False
+            self.bus.unsubscribe()
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus(source=0):
+    with _buses_lock:
+        if source not in _buses:
+            _buses[source] = FrameBus(source)
+        return _buses[source]
+
+
+def open_camera(source=0):
+    return get_bus(source).subscribe()
+
+
+def configure(source=0, **settings):
+    # width, height, fps, fourcc, buffer_size; applied the next time the
+    # device is opened
+    get_bus(source).capture.update(settings)
+
+
+def status():
+    with _buses_lock:
+        buses = list(_buses.values())
+    return {str(bus.source): bus.status() for bus in buses}
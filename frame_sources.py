@@ -0,0 +1,238 @@
+# Frame sources the frame bus (and the benchmark) can read from instead of a
+# webcam. All of them offer the part of the cv2.VideoCapture API we use:
+# read(image=None) -> (success, frame), isOpened() and release().
+#
+#   0, 1, ...                 camera device index
+#   "clip.mp4"                video file (or stream URL)
+#   "frames/"                 directory of images, played in name order
+#   "synthetic" / "synthetic:1280x720"   generated moving test pattern
+#   any object with read()    used as is
+#
+# Installations with several cameras give them names in SOURCES
+# (GESTUREFUSION_SOURCES="front=0,side=1,demo=clips/hand.mp4"); features and
+# requests then pick a camera by name, see resolve_source().
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class VideoFileSource:
+    def __init__(self, path, loop=True, realtime=True):
+        self.path = path
+        self.loop = loop
+        self.realtime = realtime  # pace reads to the clip's frame rate like a camera would
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        self.next_time = 0.0
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def read(self, image=None):
+        if not self.isOpened():
+            return False, None
+        if self.realtime:
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time, time.perf_counter() - self.interval) + self.interval
+        success, frame = self.cap.read(image)
+        if not success and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.cap.read(image)
+        if not success:
+            self.release()
+        return success, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class ImageDirectorySource:
+    def __init__(self, path, loop=True, realtime=True, fps=30):
+        self.files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                            if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.loop = loop
+        self.realtime = realtime
+        self.interval = 1.0 / fps
+        self.next_time = 0.0
+        self.index = 0
+        self.opened = bool(self.files)
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+        if self.index >= len(self.files):
+            if not self.loop:
+                self.opened = False
+                return False, None
+            self.index = 0
+        if self.realtime:
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time, time.perf_counter() - self.interval) + self.interval
+        frame = cv2.imread(self.files[self.index])
+        self.index += 1
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+class SyntheticSource:
+    # Deterministic textured background panning sideways with a bright square
+    # bouncing over it, so motion, edges and flow all have something to do
+    def __init__(self, width=640, height=480, frames=None, realtime=True, fps=30, seed=0):
+        rng = np.random.default_rng(seed)
+        noise = rng.integers(0, 255, (height, width * 2, 3), dtype=np.uint8)
+        self.background = cv2.GaussianBlur(noise, (9, 9), 0)
+        self.width, self.height = width, height
+        self.frames = frames
+        self.realtime = realtime
+        self.interval = 1.0 / fps
+        self.next_time = 0.0
+        self.count = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self, image=None):
+        if not self.opened or (self.frames is not None and self.count >= self.frames):
+            self.opened = False
+            return False, None
+        if self.realtime:
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time, time.perf_counter() - self.interval) + self.interval
+
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        x = (self.count * 4) % self.width
+        image[:] = self.background[:, x:x + self.width]
+        size = self.height // 6
+        t = self.count % 120
+        bx = int((self.width - size) * abs(t - 60) / 60)
+        by = int((self.height - size) * abs((self.count * 3) % 120 - 60) / 60)
+        cv2.rectangle(image, (bx, by), (bx + size, by + size), (255, 255, 255), -1)
+        self.count += 1
+        return True, image
+
+    def release(self):
+        self.opened = False
+
+
+# What a camera is asked for unless configured otherwise (frame_bus.configure
+# or GESTUREFUSION_CAPTURE). Without MJPG most USB cameras only deliver high
+# resolutions at a few frames per second; a one frame driver buffer keeps
+# frames from queueing up behind a slow reader.
+DEFAULT_CAPTURE = {"width": 640, "height": 480, "fps": 30, "fourcc": "MJPG", "buffer_size": 1}
+
+_CAPTURE_PROPS = {
+    "width": cv2.CAP_PROP_FRAME_WIDTH,
+    "height": cv2.CAP_PROP_FRAME_HEIGHT,
+    "fps": cv2.CAP_PROP_FPS,
+    "buffer_size": cv2.CAP_PROP_BUFFERSIZE,
+}
+
+
+def parse_capture(spec):
+    # "1280x720", "1280x720@60", optionally followed by ",YUYV" for the FOURCC
+    settings = {}
+    mode, _, fourcc = spec.partition(",")
+    size, _, fps = mode.partition("@")
+    if size:
+        settings["width"], settings["height"] = (int(v) for v in size.lower().split("x"))
+    if fps:
+        settings["fps"] = float(fps)
+    if fourcc:
+        settings["fourcc"] = fourcc.strip()
+    return settings
+
+
+def _fourcc_text(code):
+    code = int(code)
+    return "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)) if code > 0 else ""
+
+
+def configure_capture(cap, width=None, height=None, fps=None, fourcc=None, buffer_size=None):
+    # Asks the camera for the given mode and reads back what it settled on,
+    # drivers silently pick the nearest mode they support. Returns
+    # {"requested": ..., "actual": ..., "mismatched": [names]}
+    requested = {k: v for k, v in (("width", width), ("height", height), ("fps", fps),
+                                   ("fourcc", fourcc), ("buffer_size", buffer_size)) if v is not None}
+    if fourcc:
+        # Before the size: some drivers only list the large modes for MJPG
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    for name, prop in _CAPTURE_PROPS.items():
+        if name in requested:
+            cap.set(prop, requested[name])
+
+    actual = {name: cap.get(prop) for name, prop in _CAPTURE_PROPS.items()}
+    actual["width"], actual["height"] = int(actual["width"]), int(actual["height"])
+    actual["buffer_size"] = int(actual["buffer_size"])
+    actual["fourcc"] = _fourcc_text(cap.get(cv2.CAP_PROP_FOURCC))
+    mismatched = [name for name, value in requested.items()
+                  if (abs(actual[name] - value) > 0.5 if name == "fps" else actual[name] != value)]
+    return {"requested": requested, "actual": actual, "mismatched": mismatched}
+
+
+def open_source(source, realtime=True, loop=True):
+    if hasattr(source, "read"):
+        return source
+    if isinstance(source, int):
+        return cv2.VideoCapture(source)
+    if source.startswith("synthetic"):
+        width, height = 640, 480
+        if ":" in source:
+            width, height = (int(v) for v in source.split(":", 1)[1].split("x"))
+        return SyntheticSource(width, height, realtime=realtime)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, loop=loop, realtime=realtime)
+    return VideoFileSource(source, loop=loop, realtime=realtime)
+
+
+def _parse_source(spec):
+    spec = spec.strip()
+    return int(spec) if spec.isdigit() else spec
+
+
+def parse_sources(spec):
+    # "front=0,side=1,demo=clips/hand.mp4" -> {"front": 0, "side": 1, ...}
+    sources = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, source = item.partition("=")
+        sources[name.strip()] = _parse_source(source)
+    return sources
+
+
+SOURCES = {"default": 0, **parse_sources(os.environ.get("GESTUREFUSION_SOURCES", ""))}
+
+
+def register_source(name, source):
+    SOURCES[name] = source
+
+
+def resolve_source(name):
+    # Registered name -> camera index, path or source object; KeyError when unknown
+    if name is None:
+        name = "default"
+    return SOURCES[name]
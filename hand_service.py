@@ -0,0 +1,129 @@
+# One MediaPipe Hands graph per camera and hand count, shared by every hand
+# feature asking for that many hands.
+# Results are cached by the frame id handed out by the frame bus, so when the
+# drawing canvas, volume control and mouse control look at the same frame the
+# BGR->RGB conversion and the inference only run once.
+
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import models
+import scheduler
+from buffers import BufferPool
+
+
+class HandResult:
+    # Same attribute names as the MediaPipe results object, plus the landmarks
+    # as a (hands, 21, 3) float32 array of normalized x, y, z. MediaPipe has no
+    # per-hand detection score in its results (multi_handedness holds the
+    # left/right probability), confidence is applied by the graph itself
+    # through min_detection_confidence and min_tracking_confidence.
+
+    def __init__(self, multi_hand_landmarks=None, multi_handedness=None):
+        self.multi_hand_landmarks = multi_hand_landmarks or None
+        self.multi_handedness = multi_handedness or None
+        hands = multi_hand_landmarks or []
+        self.landmarks = np.array(
+            [[(lm.x, lm.y, lm.z) for lm in hand.landmark] for hand in hands],
+            dtype=np.float32).reshape(len(hands), 21, 3)
+
+    def select(self, max_hands):
+        # At most max_hands hands (the static image graph may find more)
+        if not self.multi_hand_landmarks or len(self.multi_hand_landmarks) <= max_hands:
+            return self
+        return HandResult(self.multi_hand_landmarks[:max_hands],
+                          self.multi_handedness[:max_hands] if self.multi_handedness else None)
+
+
+class HandLandmarkService:
+    def __init__(self, max_hands=2, detectionCon=0.5, trackCon=0.5, static_image_mode=False, cache_size=8):
+        self.max_hands = max_hands
+        self.detectionCon = detectionCon
+        self.trackCon = trackCon
+        self.hands = models.mediapipe().solutions.hands.Hands(
+            static_image_mode=static_image_mode,
+            max_num_hands=max_hands,
+            min_detection_confidence=detectionCon,
+            min_tracking_confidence=trackCon
+        )
+        self.roi_hands = None  # second graph for ROI crops, built on first use
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.buffers = BufferPool()  # RGB conversions, used under the lock
+
+    def process(self, img, frame_id=None, roi=None, width=None):
+        # roi = (x0, y0, x1, y1) in pixels runs the landmarks on that crop only,
+        # the returned landmarks are still normalized to the full image.
+        # width downscales images wider than that before inference, landmarks
+        # are normalized so they map back to any size.
+        # MediaPipe graphs are not thread safe, so callers take turns; whoever
+        # comes second for the same frame gets the cached result
+        scale = width / img.shape[1] if width and img.shape[1] > width else 1.0
+        key = (frame_id, roi, scale)
+        with self.lock:
+            if frame_id is not None and key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            if roi is None:
+                imgRGB = self._rgb(img, scale, "rgb")
+                results = self.hands.process(imgRGB)
+            else:
+                results = self._process_roi(img, roi, scale)
+            result = HandResult(results.multi_hand_landmarks, results.multi_handedness)
+
+            if frame_id is not None:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            return result
+
+    def _rgb(self, img, scale, name):
+        if scale != 1.0:
+            h, w = img.shape[:2]
+            size = (max(round(w * scale), 1), max(round(h * scale), 1))
+            img = cv2.resize(img, size, dst=self.buffers.get(name + "_small", (size[1], size[0], 3)),
+                             interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self.buffers.get(name, img.shape))
+
+    def _process_roi(self, img, roi, scale=1.0):
+        if self.roi_hands is None:
+            # Crops jump around with the hand, so they get their own graph and
+            # never disturb the tracking state of the full-frame one. With
+            # max_num_hands of the features using it (one for the mouse) it
+            # tracks instead of running palm detection on every crop. Built on
+            # a pipeline thread, so keep its graph threads off that thread's cores
+            with scheduler.unpinned():
+                self.roi_hands = models.mediapipe().solutions.hands.Hands(
+                    static_image_mode=False,
+                    max_num_hands=self.max_hands,
+                    min_detection_confidence=self.detectionCon,
+                    min_tracking_confidence=self.trackCon
+                )
+        x0, y0, x1, y1 = roi
+        h, w = img.shape[:2]
+        crop = self._rgb(img[y0:y1, x0:x1], scale, "roi_rgb")
+        results = self.roi_hands.process(crop)
+
+        # Map crop coordinates back to the full image
+        sx, sy = (x1 - x0) / w, (y1 - y0) / h
+        for hand in results.multi_hand_landmarks or []:
+            for lm in hand.landmark:
+                lm.x = x0 / w + lm.x * sx
+                lm.y = y0 / h + lm.y * sy
+                lm.z = lm.z * sx
+        return results
+
+
+def get_service(source=0, max_hands=1):
+    # Built on first use and kept in the shared model cache. max_hands is part
+    # of the key: MediaPipe only skips palm detection while it tracks
+    # max_num_hands hands, so a one-hand feature on a two-hand graph would
+    # pay for palm detection on every frame, and could be handed a second
+    # person's hand. Shared graphs run at MediaPipe's default confidences, so
+    # every feature on the camera can share them.
+    return models.get(("hands", source, max_hands), lambda: HandLandmarkService(max_hands))
@@ -0,0 +1,152 @@
+# Per-feature timing and frame counters, served by the /metrics route.
+# Every stage keeps a rolling window of durations so p50/p95/p99 reflect the
+# last few hundred frames. Stages:
+#   capture   - waiting for a frame from the camera
+#   inference - model calls (MediaPipe, Haar, optical flow), timed by the features
+#   draw      - rest of process_frame: overlays, compositing, filters
+#   process   - whole process_frame
+#   encode    - JPEG encoding
+#   send      - handing a chunk to the client (time until the server asks for the next one)
+#   latency   - capture timestamp to encoded frame
+#   actuate   - OS call made by the actuator thread (cursor, click, volume)
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+STAGES = ("capture", "inference", "draw", "process", "encode", "send", "latency", "actuate")
+COUNTERS = ("frames", "encoded", "sent", "dropped_process", "dropped_encode", "skipped_viewer",
+            "deduplicated", "encoded_bytes", "actuated", "coalesced")
+
+
+class FrameRate:
+    # Frames per second over the last second, from recent frame end times
+    def __init__(self, window=600):
+        self.ends = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def tick(self, t=None):
+        with self.lock:
+            self.ends.append(time.perf_counter() if t is None else t)
+
+    def fps(self):
+        with self.lock:
+            if len(self.ends) < 2:
+                return 0.0
+            now = time.perf_counter()
+            recent = [t for t in self.ends if now - t <= 1.0]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / (recent[-1] - recent[0]) if recent[-1] > recent[0] else 0.0
+
+
+class FeatureMetrics:
+    # Shared by every instance of a feature (one per session and source), so
+    # the numbers cover all of them. The inference time of the frame being
+    # processed is kept per thread, each instance processes on its own one.
+    def __init__(self, name, window=600):
+        self.name = name
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.gauges = {}  # current settings such as the adaptive JPEG quality
+        self.rate = FrameRate(window)
+        self.current = threading.local()  # .inference: seconds in the frame so far
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def set_gauge(self, gauge, value):
+        with self.lock:
+            self.gauges[gauge] = value
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.record(stage, elapsed)
+            if stage == "inference":
+                self.current.inference = getattr(self.current, "inference", 0.0) + elapsed
+
+    @contextmanager
+    def frame(self, rate=None):
+        # Wraps one process_frame call, draw time is whatever is not inference.
+        # rate: the calling instance's own FrameRate, ticked as well
+        self.current.inference = 0.0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.samples["process"].append(end - start)
+                self.samples["draw"].append(max(end - start - self.current.inference, 0.0))
+                self.counters["frames"] += 1
+            self.rate.tick(end)
+            if rate is not None:
+                rate.tick(end)
+
+    def fps(self):
+        # Frames per second of all instances together
+        return self.rate.fps()
+
+    def snapshot(self):
+        with self.lock:
+            samples = {stage: np.array(values) for stage, values in self.samples.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        stages = {}
+        for stage, values in samples.items():
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            stages[stage] = {"count": len(values), "mean_ms": float(values.mean() * 1000),
+                             "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+        return {"fps": self.fps(), "stages": stages, "counters": counters, "gauges": gauges}
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_metrics(name):
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = FeatureMetrics(name)
+        return _registry[name]
+
+
+def snapshot_all():
+    with _registry_lock:
+        features = list(_registry.values())
+    return {m.name: m.snapshot() for m in features}
+
+
+def prometheus_text():
+    lines = ["# TYPE gesturefusion_stage_seconds summary",
+             "# TYPE gesturefusion_frames_total counter",
+             "# TYPE gesturefusion_fps gauge",
+             "# TYPE gesturefusion_setting gauge"]
+    for name, snap in snapshot_all().items():
+        for stage, s in snap["stages"].items():
+            for q in ("50", "95", "99"):
+                lines.append(f'gesturefusion_stage_seconds{{feature="{name}",stage="{stage}",quantile="0.{q}"}} '
+                             f'{s["p" + q + "_ms"] / 1000:.6f}')
+            lines.append(f'gesturefusion_stage_seconds_count{{feature="{name}",stage="{stage}"}} {s["count"]}')
+        for counter, value in snap["counters"].items():
+            lines.append(f'gesturefusion_frames_total{{feature="{name}",counter="{counter}"}} {value}')
+        lines.append(f'gesturefusion_fps{{feature="{name}"}} {snap["fps"]:.2f}')
+        for gauge, value in snap["gauges"].items():
+            lines.append(f'gesturefusion_setting{{feature="{name}",setting="{gauge}"}} {value}')
+    return "\n".join(lines) + "\n"
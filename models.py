@@ -0,0 +1,85 @@
+# Process-wide cache of heavy models and OS integrations.
+# Everything expensive (MediaPipe, Haar cascades, autopy, the Windows audio
+# endpoint) is loaded on first use through get(), once per process, and shared
+# by every feature instance and session. A loader that fails is remembered, so
+# a missing backend disables the features that need it without being retried
+# on every request, and without affecting any other feature.
+
+import importlib
+import threading
+import time
+
+import cv2
+
+_entries = {}   # key -> _Entry
+_lock = threading.Lock()
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.error = None
+        self.loaded = False
+        self.load_time = 0.0
+
+
+def get(key, loader):
+    # Returns the cached value for key, calling loader() the first time.
+    # Different keys load in parallel, the same key only once.
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = _entries[key] = _Entry()
+    with entry.lock:
+        if not entry.loaded and entry.error is None:
+            start = time.perf_counter()
+            try:
+                entry.value = loader()
+                entry.loaded = True
+            except Exception as e:
+                entry.error = e
+            entry.load_time = time.perf_counter() - start
+    if entry.error is not None:
+        raise entry.error
+    return entry.value
+
+
+def put(key, value):
+    # Installs a ready value, e.g. a stand-in backend for tests or benchmarks
+    with _lock:
+        entry = _entries[key] = _Entry()
+    entry.value, entry.loaded = value, True
+
+
+def forget(key):
+    with _lock:
+        _entries.pop(key, None)
+
+
+def status():
+    with _lock:
+        entries = dict(_entries)
+    return {str(key): {"loaded": e.loaded, "load_ms": round(e.load_time * 1000, 1),
+                       **({"error": f"{type(e.error).__name__}: {e.error}"} if e.error else {})}
+            for key, e in entries.items()}
+
+
+def module(name):
+    # Optional dependency imported on first use
+    return get(("module", name), lambda: importlib.import_module(name))
+
+
+def mediapipe():
+    return module("mediapipe")
+
+
+def haar_cascade(filename, source=0):
+    # One per camera: a CascadeClassifier must not run detectMultiScale from
+    # two threads at once, and each camera's face feature has its own thread
+    def load():
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + filename)
+        if cascade.empty():
+            raise OSError(f"could not load Haar cascade {filename}")
+        return cascade
+    return get(("haar", filename, source), load)
@@ -3,89 +3,106 @@
 
 import cv2
 import numpy as np
-import time
-import autopy
+import actuator
 import HandTrackingModule as htm  
+from camera_feature import CameraFeature
+
+class MouseControl(CameraFeature):
+    name = "mouse"
+    jpeg_quality = 70  # the stream is only a preview, the cursor is what matters
+    # Speed-adaptive smoothing in screen pixels; the cursor is aimed at where
+    # the finger will be once the actuator has moved it (up to 1/60 s later)
+    smoothing = {"filter": "one_euro", "min_cutoff": 1.0, "beta": 0.005}
+    display_lead = 0.016
 
-class MouseControl:
     def __init__(self):
-        self.cap = None
-        self.streaming = False
-        self.wCam, self.hCam = 640, 480
-        self.frameR = 100  # Frame Reduction for movement box
-        self.smoothening = 7  # Smoothing for cursor movement
-        self.pTime = 0
-        self.plocX, self.plocY = 0, 0
+        super().__init__()
+        self.frameMargin = 100 / 640  # Frame Reduction for movement box, as a share of the width
+        self.frameR = 100
         self.clocX, self.clocY = 0, 0
 
         # Initializing camera and screen
-        self.detector = htm.handDetector(maxHands=1)
-        self.wScr, self.hScr = autopy.screen.size()
-
-    def start_camera(self):
-        if not self.cap or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(0)
-        self.streaming = True
-
-    def stop_camera(self):
-        self.streaming = False
-        if self.cap:
-            self.cap.release()
-            self.cap = None
-
-    def generate(self):
-        self.start_camera()
-        while self.streaming:
-            # Capturing frame
-            success, img = self.cap.read()
-            img = self.detector.findHands(img)
-            lmList, bbox = self.detector.findPosition(img)
-
-            # Only process if hand is detected
-            if len(lmList) != 0:
-                # Get finger states
-                fingers = self.detector.fingersUp()
-
-                # Draw movement rectangle
+        # The hand barely moves while steering, so only look at the full frame every 10th frame
+        self.detector = htm.handDetector(maxHands=1, source=self.source, trackInterval=10,
+                                         inferenceWidth=self.inference_width)
+        self.actuator = None  # opened on the first frame, it needs a display
+        self.wScr, self.hScr = 0, 0
+        self.pinched = False
+
+    def load(self):
+        super().load()
+        self.actuator = actuator.mouse()
+        self.wScr, self.hScr = self.actuator.backend.screen_size()
+
+    def initial_events(self):
+        # The client draws the movement box itself in overlay mode
+        events = super().initial_events()
+        events[0]["frame_margin"] = self.frameR
+        return events
+
+    def process_frame(self, img):
+        # The movement box follows the size the camera actually delivers
+        self.frameR = int(self.wCam * self.frameMargin)
+        with self.metrics.timer("inference"):
+            img = self.detector.findHands(img, draw=self.render, frame_id=self.frame_id)
+        lmList, bbox = self.detector.findPosition(img, draw=self.render)
+
+        # Only process if hand is detected
+        if len(lmList) != 0:
+            # Get finger states
+            fingers = self.detector.fingersUp()
+
+            # Draw movement rectangle
+            if self.render:
                 cv2.rectangle(img, (self.frameR, self.frameR), (self.wCam - self.frameR, self.hCam - self.frameR),
                               (255, 0, 255), 2)
 
-                # Moving Mode: Only index finger up
-                if len(fingers) >= 3 and fingers[1] == 1 and fingers[2] == 0:
-                    x1, y1 = lmList[8][1:]
+            # Moving Mode: Only index finger up
+            if len(fingers) >= 3 and fingers[1] == 1 and fingers[2] == 0:
+                x1, y1 = lmList[8][1:]
 
-                    # Convert to screen coordinates
-                    x3 = np.interp(x1, (self.frameR, self.wCam - self.frameR), (0, self.wScr))
-                    y3 = np.interp(y1, (self.frameR, self.hCam - self.frameR), (0, self.hScr))
+                # Convert to screen coordinates
+                x3 = np.interp(x1, (self.frameR, self.wCam - self.frameR), (0, self.wScr))
+                y3 = np.interp(y1, (self.frameR, self.hCam - self.frameR), (0, self.hScr))
 
-                    # Smooth cursor movement
-                    self.clocX = self.plocX + (x3 - self.plocX) / self.smoothening
-                    self.clocY = self.plocY + (y3 - self.plocY) / self.smoothening
+                # Smooth cursor movement, extrapolated from the capture time
+                self.smoother.update((x3, y3), self.frame_time)
+                x4, y4 = self.smoother.predict(self.display_time())
+                self.clocX, self.clocY = np.clip(x4, 0, self.wScr - 1), np.clip(y4, 0, self.hScr - 1)
 
-                    # Move mouse
-                    autopy.mouse.move(self.wScr - self.clocX, self.clocY)
+                # Move mouse, the actuator thread only applies the latest position
+                self.actuator.submit("move", self.wScr - self.clocX, self.clocY)
+                self.pinched = False
+                self.set_gesture("move")
+                if self.render:
                     cv2.circle(img, (x1, y1), 15, (255, 0, 255), cv2.FILLED)
-                    self.plocX, self.plocY = self.clocX, self.clocY
 
-                # Clicking Mode: Index and middle fingers up
-                elif len(fingers) >= 3 and fingers[1] == 1 and fingers[2] == 1:
-                    length, img, lineInfo = self.detector.findDistance(8, 12, img)
-                    if length < 40:
+            # Clicking Mode: Index and middle fingers up
+            elif len(fingers) >= 3 and fingers[1] == 1 and fingers[2] == 1:
+                length, img, lineInfo = self.detector.findDistance(8, 12, img, draw=self.render)
+                # Click once when the fingers close, not on every frame they
+                # stay closed; they have to open past 50 before the next click
+                # (pixels of a 640 wide frame, scaled like frameMargin)
+                length /= self.wCam / 640
+                was_pinched, self.pinched = self.pinched, length < (50 if self.pinched else 40)
+                if self.pinched:
+                    if self.render:
                         cv2.circle(img, (lineInfo[4], lineInfo[5]),
                                    15, (0, 255, 0), cv2.FILLED)
-                        autopy.mouse.click()
-
-            # Display FPS
-            cTime = time.time()
-            fps = 1 / (cTime - self.pTime) if cTime != self.pTime else 0
-            self.pTime = cTime
-            cv2.putText(img, f"FPS: {int(fps)}", (20, 80),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-            # Show the frame
-            ret, buffer = cv2.imencode('.jpg', img)
-            if not ret:
-                continue
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-
-        self.stop_camera()
+                    if not was_pinched:
+                        self.actuator.trigger("click")
+                    self.set_gesture("click")
+                else:
+                    self.set_gesture("click_ready")
+            else:
+                self.pinched = False
+                self.set_gesture("idle")
+
+        # Display FPS
+        if not self.render:
+            return img
+        fps = self.rate.fps()
+        cv2.putText(img, f"FPS: {int(fps)}", (20, 80),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+        return img
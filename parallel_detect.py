@@ -0,0 +1,96 @@
+# Haar face/eye detection spread over a pool of worker processes.
+# Each frame is cut into overlapping tiles, every tile is searched in its own
+# process and the boxes are merged back with non-maximum suppression. A frame
+# is finished before the next one is submitted, so frames stay in order.
+# Neighbouring tiles overlap by the largest face searched (max_face of the
+# shorter frame side, also passed as maxSize), so every face that can be found
+# lies wholly inside at least one tile.
+
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+_face_cascade = None
+_eye_cascade = None
+
+
+def _init_worker():
+    global _face_cascade, _eye_cascade
+    cv2.setNumThreads(1)  # the pool already uses the other cores
+    _face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    _eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+
+
+def _detect_tile(tile, ox, oy, max_size, find_eyes):
+    faces = _face_cascade.detectMultiScale(tile, scaleFactor=1.1, minNeighbors=5, maxSize=(max_size, max_size))
+    results = []
+    for (x, y, w, h) in faces:
+        eyes = []
+        if find_eyes:
+            eyes = _eye_cascade.detectMultiScale(tile[y:y + h, x:x + w], scaleFactor=1.1, minNeighbors=10)
+            eyes = [tuple(int(v) for v in e) for e in eyes]
+        results.append(((int(x + ox), int(y + oy), int(w), int(h)), eyes))
+    return results
+
+
+def non_max_suppression(boxes, threshold=0.3):
+    # Greedy NMS on x, y, w, h boxes, larger boxes win. A box is also dropped
+    # when it lies mostly inside a kept one (a face cut by a tile edge).
+    if len(boxes) == 0:
+        return []
+    boxes = np.asarray(boxes, dtype=np.float32)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    order = np.argsort(-areas)
+    keep = []
+    while len(order):
+        i, rest = order[0], order[1:]
+        keep.append(int(i))
+        iw = np.maximum(0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        ih = np.maximum(0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = iw * ih
+        iou = inter / (areas[i] + areas[rest] - inter)
+        inside = inter / areas[rest]
+        order = rest[(iou <= threshold) & (inside <= 0.6)]
+    return keep
+
+
+class TiledFaceDetector:
+    def __init__(self, workers=4, max_face=0.6):
+        self.workers = workers
+        self.max_face = max_face  # largest face searched, as a fraction of the shorter frame side
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+
+    def max_size(self, shape):
+        return int(min(shape[:2]) * self.max_face)
+
+    def tiles(self, shape):
+        # A face of up to max_size pixels across a tile border is whole in the
+        # tile on one side of it when the tiles overlap by max_size
+        h, w = shape[:2]
+        cols = math.ceil(math.sqrt(self.workers))
+        rows = math.ceil(self.workers / cols)
+        pad = (self.max_size(shape) + 1) // 2
+        for r in range(rows):
+            for c in range(cols):
+                x0, x1 = c * w // cols, (c + 1) * w // cols
+                y0, y1 = r * h // rows, (r + 1) * h // rows
+                yield max(x0 - pad, 0), max(y0 - pad, 0), min(x1 + pad, w), min(y1 + pad, h)
+
+    def detect(self, gray, find_eyes=True):
+        # Returns [((x, y, w, h), eyes)] with eyes relative to their face box
+        max_size = self.max_size(gray.shape)
+        futures = [self.pool.submit(_detect_tile, gray[y0:y1, x0:x1], x0, y0, max_size, find_eyes)
+                   for x0, y0, x1, y1 in self.tiles(gray.shape)]
+        found = [face for future in futures for face in future.result()]
+        keep = non_max_suppression([box for box, _ in found])
+        return [found[i] for i in keep]
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,299 @@
+# Runs a feature as three threaded stages: capture -> process -> encode.
+# The stages are connected by LatestQueues that only keep the newest item, so a
+# slow MediaPipe call drops stale frames instead of queueing them up. Each frame
+# is encoded once (see encoder.FrameEncoder) and handed to a FrameBroadcaster that any number of viewers
+# read from, so latency seen in the browser stays constant under load.
+# Captured frames come from the pipeline's BufferPool and go back to it once
+# processed and encoded (or dropped), so the capture never allocates.
+# When the source cannot be read at all (no camera, a bad path) the stages
+# wind down in order: whatever is queued, then the frame from lost_frame() (if
+# any) as the last one, then the pipeline is marked failed, which ends its
+# viewers' streams.
+
+import asyncio
+import json
+import threading
+import time
+import traceback
+from collections import deque
+
+from buffers import BufferPool
+from encoder import FrameEncoder
+
+
+class LatestQueue:
+    # Bounded queue that drops the oldest item when full, on_drop(item) is
+    # called for it
+
+    def __init__(self, maxsize=1, on_drop=None):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.on_drop = on_drop
+
+    def put(self, item):
+        # Returns True when an older item had to be dropped
+        with self.cond:
+            dropped = len(self.items) == self.items.maxlen
+            if dropped:
+                self.dropped += 1
+                if self.on_drop:
+                    self.on_drop(self.items[0])
+            self.items.append(item)
+            self.cond.notify()
+            return dropped
+
+    def get(self, timeout=1.0):
+        with self.cond:
+            self.cond.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class _AsyncWaiters:
+    # Lets asyncio tasks wait on a broadcaster without a thread each. Waiters
+    # register an asyncio.Event and the publishing thread sets them through
+    # their event loop, one call_soon_threadsafe per loop.
+
+    def __init__(self):
+        self.async_waiters = []
+
+    def _wake_async(self):
+        # Called with self.cond held
+        waiters, self.async_waiters = self.async_waiters, []
+        by_loop = {}
+        for loop, event in waiters:
+            by_loop.setdefault(loop, []).append(event)
+        for loop, events in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, events)
+            except RuntimeError:  # loop already closed
+                pass
+
+    async def _wait_async(self, ready, timeout):
+        event = asyncio.Event()
+        with self.cond:
+            if ready():
+                return
+            self.async_waiters.append((asyncio.get_running_loop(), event))
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            with self.cond:
+                self.async_waiters = [w for w in self.async_waiters if w[1] is not event]
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
+
+
+class FrameBroadcaster(_AsyncWaiters):
+    # Holds the latest encoded chunk for any number of viewers.
+    # Each viewer remembers the sequence number it sent last and waits for a
+    # newer one, so a slow viewer simply skips frames without slowing the rest.
+
+    def __init__(self):
+        super().__init__()
+        self.seq = 0
+        self.chunk = None
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.seq += 1
+            self.chunk = chunk
+            self.cond.notify_all()
+            self._wake_async()
+
+    def _ready(self, last_seq):
+        return self.seq > last_seq and self.chunk is not None
+
+    def wait_next(self, last_seq, timeout=1.0):
+        with self.cond:
+            self.cond.wait_for(lambda: self._ready(last_seq), timeout)
+            if not self._ready(last_seq):
+                return last_seq, None
+            return self.seq, self.chunk
+
+    async def wait_next_async(self, last_seq, timeout=1.0):
+        await self._wait_async(lambda: self._ready(last_seq), timeout)
+        with self.cond:
+            if not self._ready(last_seq):
+                return last_seq, None
+            return self.seq, self.chunk
+
+    def clear(self):
+        # Forget the last frame so new viewers never see a stale one
+        with self.cond:
+            self.chunk = None
+
+
+class EventBroadcaster(_AsyncWaiters):
+    # Small JSON messages (landmarks, gesture changes) for WebSocket viewers.
+    # The last maxlen events are kept; a reader that falls further behind
+    # loses the oldest ones. Features only build events while listeners > 0.
+
+    def __init__(self, maxlen=64):
+        super().__init__()
+        self.seq = 0
+        self.events = deque(maxlen=maxlen)  # (seq, json text)
+        self.listeners = 0
+        self.cond = threading.Condition()
+
+    def publish(self, event):
+        text = json.dumps(event, separators=(",", ":"))
+        with self.cond:
+            self.seq += 1
+            self.events.append((self.seq, text))
+            self.cond.notify_all()
+            self._wake_async()
+
+    def events_after(self, last_seq):
+        with self.cond:
+            return self.seq, [text for seq, text in self.events if seq > last_seq]
+
+    async def wait_after_async(self, last_seq, timeout=1.0):
+        await self._wait_async(lambda: self.seq > last_seq, timeout)
+        return self.events_after(last_seq)
+
+    def add_listener(self):
+        with self.cond:
+            self.listeners += 1
+            return self.seq
+
+    def remove_listener(self):
+        with self.cond:
+            self.listeners = max(self.listeners - 1, 0)
+
+
+class FramePipeline:
+    def __init__(self, cap, process, output=None, metrics=None, queue_size=1, encoder=None, pool=None,
+                 lost_frame=None):
+        # cap is a frame_bus.FrameSubscription, process(frame_id, timestamp, frame),
+        # metrics an optional metrics.FeatureMetrics, lost_frame() the image
+        # shown when the source stops delivering
+        self.cap = cap
+        self.process = process
+        self.lost_frame = lost_frame
+        self.metrics = metrics
+        self.encoder = encoder or FrameEncoder()
+        self.pool = pool or BufferPool()
+        release = self.pool.release
+        self.frames = LatestQueue(queue_size, lambda item: release(item[2]))   # capture -> process
+        self.results = LatestQueue(queue_size, lambda item: release(item[1]))  # process -> encode
+        self.output = output or FrameBroadcaster()  # encode -> viewers
+        self.running = False
+        self.failed = False
+        self.source_lost = False
+        self.threads = []
+        # Frames through each stage and the time spent in them, for the
+        # scheduler's load estimate and per-source throughput
+        self.processed = self.encoded = 0
+        self.busy = self.encode_busy = 0.0
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._run_stage, args=(self._capture,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._process,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._encode,), daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for queue in (self.frames, self.results):
+            queue.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
+
+    def _run_stage(self, step):
+        # A step returns False when its stage is done for good
+        try:
+            while self.running and step() is not False:
+                pass
+        except Exception:
+            traceback.print_exc()
+            self.failed = True
+            self.running = False
+            for queue in (self.frames, self.results):
+                queue.close()
+
+    def _capture(self):
+        start = time.perf_counter()
+        buffer = self.pool.acquire()  # a frame the later stages are done with
+        success, frame = self.cap.read(buffer)
+        if not success:
+            self.pool.release(buffer)
+            if not self.cap.isOpened():
+                # Reads now fail at once, retrying would only spin
+                self.source_lost = True
+                self.frames.close()
+                return False
+        else:
+            self.pool.adopt(frame)
+            dropped = self.frames.put((self.cap.frame_id, self.cap.timestamp, frame))
+            if self.metrics:
+                self.metrics.record("capture", time.perf_counter() - start)
+                if dropped:
+                    self.metrics.count("dropped_process")
+
+    def _process(self):
+        item = self.frames.get()
+        if item is None:
+            if self.source_lost:
+                frame = self.lost_frame() if self.lost_frame else None
+                if frame is not None:
+                    self.results.put((time.perf_counter(), frame))
+                self.results.close()
+                return False
+            return
+        start = time.perf_counter()
+        result = self.process(*item)
+        self.busy += time.perf_counter() - start
+        self.processed += 1
+        if result is not item[2]:
+            # The feature drew into a buffer of its own, the frame is free again
+            self.pool.release(item[2])
+        if result is not None:
+            dropped = self.results.put((item[1], result))
+            if self.metrics and dropped:
+                self.metrics.count("dropped_encode")
+
+    def _encode(self):
+        item = self.results.get()
+        if item is None:
+            if self.source_lost and self.results.closed:
+                self.failed = True
+                return False
+            return
+        timestamp, result = item
+        start = time.perf_counter()
+        chunk = self.encoder.encode(result)
+        self.pool.release(result)
+        self.encode_busy += time.perf_counter() - start
+        self.encoded += 1
+        if chunk is None:
+            if self.metrics:
+                self.metrics.count("deduplicated")
+            return
+        self.output.publish(chunk)
+        if self.metrics:
+            end = time.perf_counter()
+            self.metrics.record("encode", end - start)
+            self.metrics.record("latency", end - timestamp)
+            self.metrics.count("encoded")
+            self.metrics.count("encoded_bytes", len(chunk))
+            self.metrics.set_gauge("jpeg_quality", self.encoder.quality)
+            self.metrics.set_gauge("stream_scale", self.encoder.scale)
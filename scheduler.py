@@ -0,0 +1,228 @@
+# Spreads the feature pipelines of several cameras over the CPU cores.
+# Every running FramePipeline is attached with the source it reads. Every
+# interval seconds the scheduler measures how many cores' worth of processing
+# and encoding each source's pipelines used, and gives each source a share of
+# the cores in proportion: a camera feeding hand tracking gets more cores than
+# one that only shows filters. The pipeline threads and the source's capture
+# thread are pinned to that share (Linux thread affinity). With a single
+# source, or where affinity is not available, nothing is pinned and the
+# scheduler only reports.
+#
+# All cameras run in one process, so they share the models (MediaPipe graphs,
+# cascades) instead of loading them once per app process. With the GIL, only
+# the native calls that release it (OpenCV, MediaPipe, JPEG encoding) run in
+# parallel, so pinning spreads those; the Python parts still take turns.
+#
+# A new thread inherits the affinity of the thread that starts it. Only the
+# Python stage threads are pinned: OpenCV's worker pool is started before the
+# first pin, and models load inside unpinned(), so MediaPipe graph threads and
+# worker processes can use every core whichever camera loaded them.
+#
+#   GESTUREFUSION_PIN_THREADS=0   report only, never pin
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import frame_bus
+import frame_sources
+
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition(cpus, loads):
+    # source -> list of cpus. Every source gets at least one core, the rest
+    # go by load; with more sources than cores, sources share the least
+    # loaded core (longest processing time first).
+    sources = sorted(loads, key=lambda s: (-loads[s], str(s)))
+    if not sources:
+        return {}
+    if len(sources) >= len(cpus):
+        bins = {cpu: 0.0 for cpu in cpus}
+        assignment = {}
+        for source in sources:
+            cpu = min(bins, key=bins.get)
+            bins[cpu] += max(loads[source], 1e-3)
+            assignment[source] = [cpu]
+        return assignment
+
+    total = sum(loads.values())
+    spare = len(cpus) - len(sources)
+    share = {s: (loads[s] / total if total else 1 / len(sources)) * spare for s in sources}
+    counts = {s: 1 + int(share[s]) for s in sources}
+    leftover = len(cpus) - sum(counts.values())
+    for source in sorted(sources, key=lambda s: share[s] - int(share[s]), reverse=True)[:leftover]:
+        counts[source] += 1
+    assignment, start = {}, 0
+    for source in sources:
+        assignment[source] = cpus[start:start + counts[source]]
+        start += counts[source]
+    return assignment
+
+
+class Scheduler:
+    def __init__(self, interval=5.0, cpus=None, pin=None):
+        self.interval = interval
+        self.cpus = sorted(cpus or _available_cpus())
+        if pin is None:
+            pin = os.environ.get("GESTUREFUSION_PIN_THREADS", "1") != "0"
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self.pipelines = {}   # pipeline -> source
+        self.samples = {}     # pipeline -> (time, processed, encoded, busy seconds)
+        self.loads = {}       # source -> cores' worth of work over the last interval
+        self.rates = {}       # source -> (processed fps, encoded fps)
+        self.assignment = {}  # source -> cpus
+        self.pools_started = False
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def attach(self, pipeline, source):
+        with self.lock:
+            self.pipelines[pipeline] = source
+            self.samples[pipeline] = self._sample(pipeline)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+                self.thread.start()
+        self.rebalance()  # pin the new threads right away
+
+    def detach(self, pipeline):
+        with self.lock:
+            self.pipelines.pop(pipeline, None)
+            self.samples.pop(pipeline, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.pipelines:
+                    self.thread = None
+                    return
+            self.rebalance()
+
+    @staticmethod
+    def _sample(pipeline):
+        return time.perf_counter(), pipeline.processed, pipeline.encoded, pipeline.busy + pipeline.encode_busy
+
+    def measure(self):
+        loads, processed, encoded = {}, {}, {}
+        with self.lock:
+            for pipeline, source in self.pipelines.items():
+                t0, p0, e0, b0 = self.samples[pipeline]
+                sample = self.samples[pipeline] = self._sample(pipeline)
+                dt = sample[0] - t0
+                if dt <= 0:
+                    continue
+                loads[source] = loads.get(source, 0.0) + (sample[3] - b0) / dt
+                processed[source] = processed.get(source, 0.0) + (sample[1] - p0) / dt
+                encoded[source] = encoded.get(source, 0.0) + (sample[2] - e0) / dt
+            for source in set(self.pipelines.values()):
+                if source in loads:
+                    self.loads[source] = loads[source]
+                    self.rates[source] = (processed[source], encoded[source])
+            for source in list(self.loads):
+                if source not in loads and source not in self.pipelines.values():
+                    del self.loads[source]
+                    self.rates.pop(source, None)
+
+    def rebalance(self):
+        self.measure()
+        with self.lock:
+            pipelines = dict(self.pipelines)
+            loads = {source: self.loads.get(source, 0.0) for source in set(pipelines.values())}
+        if len(loads) < 2 or not self.pin:
+            assignment = {source: self.cpus for source in loads}
+        else:
+            assignment = partition(self.cpus, loads)
+
+        if self.pin and len(loads) >= 2:
+            if not self.pools_started:
+                with unpinned():
+                    _start_native_pools()
+                self.pools_started = True
+        if self.pin:
+            for pipeline, source in pipelines.items():
+                for thread in pipeline.threads:
+                    _pin(thread, assignment[source])
+            for source in loads:
+                _pin(frame_bus.get_bus(source).thread, assignment[source])
+        with self.lock:
+            self.assignment = assignment
+
+    def status(self):
+        # Per source throughput: capture fps from the frame bus, processed and
+        # encoded frames/sec summed over its pipelines, load in cores and the
+        # cores it runs on
+        names = {_key(source): name for name, source in frame_sources.SOURCES.items()}
+        captured = frame_bus.status()
+        with self.lock:
+            counts = {}
+            for source in self.pipelines.values():
+                counts[source] = counts.get(source, 0) + 1
+            report = {}
+            for source, pipelines in counts.items():
+                processed, encoded = self.rates.get(source, (0.0, 0.0))
+                bus = captured.get(str(source), {})
+                report[names.get(_key(source), str(source))] = {
+                    "source": str(source), "pipelines": pipelines,
+                    "capture_fps": bus.get("fps", 0.0), "processed_fps": round(processed, 1),
+                    "encoded_fps": round(encoded, 1), "load": round(self.loads.get(source, 0.0), 2),
+                    "cpus": list(self.assignment.get(source, self.cpus)),
+                }
+        return report
+
+
+def _key(source):
+    return source if isinstance(source, (int, str)) else id(source)
+
+
+def _start_native_pools():
+    # OpenCV starts its parallel_for pool on the first parallel call, from
+    # whichever thread makes it; make that happen here, unpinned
+    cv2.cvtColor(np.zeros((1080, 1920, 3), dtype=np.uint8), cv2.COLOR_BGR2GRAY)
+
+
+@contextmanager
+def unpinned():
+    # Runs the block with the calling thread allowed on every core, so the
+    # threads and processes it starts are not tied to one camera's share
+    if not hasattr(os, "sched_setaffinity"):
+        yield
+        return
+    before = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, default.cpus)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, before)
+
+
+def _pin(thread, cpus):
+    if thread is None or not thread.is_alive() or thread.native_id is None:
+        return
+    try:
+        os.sched_setaffinity(thread.native_id, cpus)
+    except OSError:  # the thread just exited
+        pass
+
+
+default = Scheduler()
+
+
+def attach(pipeline, source):
+    default.attach(pipeline, source)
+
+
+def detach(pipeline):
+    default.detach(pipeline)
+
+
+def status():
+    return default.status()
@@ -0,0 +1,207 @@
+# Per-client feature state.
+# Every browser gets a session (cookie) holding its own instances of the
+# stateful features: canvas and strokes, filter and flow mode, mouse smoothing,
+# volume level. Features without per-client state (CameraFeature.shared) have a
+# single instance used by every session, so they share one pipeline and one
+# encoder. The heavy parts are shared either way: all instances read the same
+# frame bus, and the hand features the same MediaPipe service.
+#
+# Each feature reads its default camera (SessionManager sources, e.g. the face
+# feature on a side camera) unless a request names another registered source
+# (frame_sources.SOURCES); instances are kept per feature and source.
+#
+# Sessions idle for longer than ttl seconds are evicted, and so are the least
+# recently used ones while the estimated memory of all sessions is above
+# max_memory_mb. A session with an open stream counts as active, never idle.
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import frame_sources
+
+COOKIE_NAME = "gf_session"
+
+
+class Session:
+    def __init__(self, manager, session_id):
+        self.manager = manager
+        self.id = session_id
+        self.features = {}   # (name, source) -> instance owned by this session
+        self.streams = 0     # open MJPEG/WebSocket viewers of this session
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def feature(self, name, source=None):
+        # source: a registered source name, None for the feature's default;
+        # KeyError when it is not registered
+        if name in self.manager.shared:
+            return self.manager.shared_feature(name, source)
+        key = self.manager.feature_key(name, source)
+        with self.lock:
+            feature = self.features.get(key)
+            if feature is None:
+                feature = self.features[key] = self.manager.build(*key)
+        return feature
+
+    def stop(self, name, source=None):
+        # Stopping a shared feature is left to its viewer count, so one client
+        # cannot end everybody's stream
+        if name not in self.manager.shared:
+            self.feature(name, source).stop_camera()
+
+    def restart(self, name, source=None):
+        if name not in self.manager.shared:
+            self.feature(name, source).stop_camera()
+        self.feature(name, source).start_camera()
+
+    def open_stream(self):
+        with self.lock:
+            self.streams += 1
+
+    def close_stream(self):
+        with self.lock:
+            self.streams -= 1
+        self.touch()
+
+    def stream(self, name, source=None):
+        # MJPEG generator that keeps the session alive while it is open
+        feature = self.feature(name, source)
+        self.open_stream()
+        try:
+            for chunk in feature.generate():
+                yield chunk
+        finally:
+            self.close_stream()
+
+    def memory_bytes(self):
+        with self.lock:
+            features = list(self.features.values())
+        return sum(f.memory_bytes() for f in features)
+
+    def close(self):
+        with self.lock:
+            features, self.features = list(self.features.values()), {}
+        for feature in features:
+            feature.stop_camera()
+
+
+def _close_all(sessions):
+    for session in sessions:
+        session.close()
+
+
+class SessionManager:
+    def __init__(self, factories, ttl=900, max_memory_mb=512, sweep_interval=10, sources=None):
+        # factories: feature name -> class or function building the feature
+        # sources: feature name -> source name it reads by default
+        self.factories = factories
+        self.sources = sources or {}
+        self.shared = {name for name, factory in factories.items() if getattr(factory, "shared", False)}
+        self.shared_features = {}
+        self.ttl = ttl
+        self.max_memory = max_memory_mb * 2 ** 20
+        self.sweep_interval = sweep_interval
+        self.sessions = OrderedDict()  # least recently used first
+        self.last_sweep = 0.0
+        self.lock = threading.Lock()
+
+    def feature_key(self, name, source=None):
+        source = source or self.sources.get(name, "default")
+        frame_sources.resolve_source(source)  # KeyError for unknown names
+        return name, source
+
+    def build(self, name, source):
+        feature = self.factories[name]()
+        feature.set_source(frame_sources.resolve_source(source))
+        return feature
+
+    def shared_feature(self, name, source=None):
+        key = self.feature_key(name, source)
+        with self.lock:
+            feature = self.shared_features.get(key)
+            if feature is None:
+                feature = self.shared_features[key] = self.build(*key)
+        return feature
+
+    def warm_up(self, names=None, background=True):
+        # Loads the models behind the given features (all by default) ahead of
+        # the first viewer. Per-client features are built once and dropped, what
+        # they load stays in the models cache for every session.
+        names = [n for n in (names or self.factories) if n in self.factories]
+
+        def run():
+            for name in names:
+                feature = self.shared_feature(name) if name in self.shared else self.build(*self.feature_key(name))
+                feature.warm_up()
+
+        if not background:
+            return run()
+        threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+    def get(self, session_id=None):
+        # The session for a cookie value, a new one when it is missing or evicted
+        with self.lock:
+            session = self.sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(self, uuid.uuid4().hex)
+                self.sessions[session.id] = session
+            else:
+                self.sessions.move_to_end(session.id)
+        session.touch()
+        self.maybe_sweep()
+        return session
+
+    def maybe_sweep(self):
+        now = time.monotonic()
+        if now - self.last_sweep >= self.sweep_interval:
+            self.last_sweep = now
+            self.sweep()
+
+    def sweep(self):
+        now = time.monotonic()
+        with self.lock:
+            sessions = list(self.sessions.values())
+        evict = [s for s in sessions if not s.streams and now - s.last_seen > self.ttl]
+
+        # Memory cap: drop least recently used sessions, idle ones first,
+        # but never the most recent one
+        remaining = [s for s in sessions if s not in evict]
+        total = sum(s.memory_bytes() for s in remaining)
+        for session in sorted(remaining[:-1], key=lambda s: s.streams > 0):
+            if total <= self.max_memory:
+                break
+            total -= session.memory_bytes()
+            evict.append(session)
+
+        if evict:
+            with self.lock:
+                for session in evict:
+                    self.sessions.pop(session.id, None)
+            # Stopping pipelines joins their threads, keep that off the request
+            threading.Thread(target=_close_all, args=(evict,), daemon=True).start()
+
+    def evict(self, session):
+        with self.lock:
+            self.sessions.pop(session.id, None)
+        session.close()
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = list(self.sessions.values()), OrderedDict()
+            shared, self.shared_features = list(self.shared_features.values()), {}
+        for session in sessions:
+            session.close()
+        for feature in shared:
+            feature.stop_camera()
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {"sessions": len(sessions),
+                "streaming": sum(1 for s in sessions if s.streams),
+                "memory_mb": round(sum(s.memory_bytes() for s in sessions) / 2 ** 20, 2)}
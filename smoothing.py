@@ -0,0 +1,126 @@
+# Smoothing for noisy landmark signals: the mouse cursor, the volume
+# distance, the drawing fingertip.
+# Every filter takes timestamped samples (capture time, in perf_counter
+# seconds) and can extrapolate its estimate to a later time, so a feature can
+# aim for where the hand will be when the result is shown instead of where it
+# was when the frame was captured.
+#
+#   exponential  fixed factor, the original MouseControl smoothing; lags in
+#                proportion to speed and does not extrapolate
+#   one_euro     cutoff rises with speed: steady when still, little lag when
+#                moving fast (Casiez et al., CHI 2012)
+#   kalman       constant-velocity Kalman filter
+#
+# make_filter({"filter": "one_euro", "beta": 0.01}) builds one from a spec.
+
+import math
+
+import numpy as np
+
+
+class MotionFilter:
+    def __init__(self, max_gap=0.5, max_lead=0.1):
+        self.max_gap = max_gap    # a longer pause (hand lost) starts over
+        self.max_lead = max_lead  # never extrapolate further than this
+        self.reset()
+
+    def reset(self):
+        self.t = None
+        self.value = None
+        self.velocity = None
+
+    def update(self, value, t):
+        # Adds a sample taken at time t, returns the smoothed value at t
+        value = np.asarray(value, dtype=np.float64)
+        if self.t is None or t - self.t > self.max_gap or self.value.shape != value.shape:
+            self.t, self.value, self.velocity = t, value, np.zeros_like(value)
+            self.start(value)
+        elif t > self.t:
+            self.step(value, t - self.t)
+            self.t = t
+        return self.value
+
+    def predict(self, t):
+        # The estimate extrapolated to time t
+        if self.t is None:
+            return None
+        lead = min(max(t - self.t, 0.0), self.max_lead)
+        return self.value + self.velocity * lead
+
+    def start(self, value):
+        pass
+
+    def step(self, value, dt):
+        raise NotImplementedError
+
+
+class ExponentialFilter(MotionFilter):
+    def __init__(self, factor=7, **kwargs):
+        self.factor = factor
+        super().__init__(**kwargs)
+
+    def step(self, value, dt):
+        self.value = self.value + (value - self.value) / self.factor
+
+
+def _alpha(cutoff, dt):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuroFilter(MotionFilter):
+    def __init__(self, min_cutoff=1.0, beta=0.007, d_cutoff=1.0, **kwargs):
+        self.min_cutoff = min_cutoff  # Hz, jitter removed when still
+        self.beta = beta              # how fast the cutoff grows with speed
+        self.d_cutoff = d_cutoff      # Hz, for the speed estimate itself
+        super().__init__(**kwargs)
+
+    def step(self, value, dt):
+        a = _alpha(self.d_cutoff, dt)
+        self.velocity = self.velocity + a * ((value - self.value) / dt - self.velocity)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.velocity)
+        tau = 1.0 / (2 * np.pi * cutoff)
+        self.value = self.value + (value - self.value) / (1.0 + tau / dt)
+
+
+class KalmanFilter(MotionFilter):
+    # Position and velocity per axis. All axes are measured together with the
+    # same noise, so they share one 2x2 covariance.
+    def __init__(self, process_noise=5000.0, measurement_noise=4.0, **kwargs):
+        self.q = process_noise       # acceleration variance, units/s^2 squared
+        self.r = measurement_noise   # measurement variance, units squared
+        super().__init__(**kwargs)
+
+    def start(self, value):
+        self.P = np.array([[self.r, 0.0], [0.0, self.q]])
+
+    def step(self, value, dt):
+        # Predict
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.q * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        position = self.value + self.velocity * dt
+        P = F @ self.P @ F.T + Q
+        # Correct
+        k = P[:, 0] / (P[0, 0] + self.r)
+        residual = value - position
+        self.value = position + k[0] * residual
+        self.velocity = self.velocity + k[1] * residual
+        self.P = P - np.outer(k, P[0])
+
+
+FILTERS = {
+    "exponential": ExponentialFilter,
+    "one_euro": OneEuroFilter,
+    "kalman": KalmanFilter,
+}
+
+
+def make_filter(spec):
+    # spec: a filter name or {"filter": name, **parameters}
+    if isinstance(spec, str):
+        spec = {"filter": spec}
+    params = dict(spec)
+    kind = params.pop("filter", "one_euro")
+    if kind not in FILTERS:
+        raise ValueError(f"unknown filter {kind!r}, expected one of {', '.join(FILTERS)}")
+    return FILTERS[kind](**params)
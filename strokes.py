@@ -0,0 +1,188 @@
+# Vector model of the air drawing.
+# Every stroke keeps its points, color, width and timestamps, so drawings can
+# be undone, redone and rasterized again at any resolution. Drawings are saved
+# as a small compressed .npz (point arrays + JSON header) by a background
+# writer instead of as a full PNG from the request thread.
+
+import json
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+DRAW, ERASE = 0, 1
+
+
+class Stroke:
+    def __init__(self, kind, color, width):
+        self.kind = kind
+        self.color = tuple(int(c) for c in color)
+        self.width = int(width)  # line thickness, or the eraser diameter
+        self.points = []
+        self.times = []
+
+    def add_point(self, x, y, t):
+        self.points.append((x, y))
+        self.times.append(t)
+
+    def finish(self):
+        # Freeze into compact arrays once the stroke is over
+        self.points = np.asarray(self.points, dtype=np.int16).reshape(-1, 2)
+        self.times = np.asarray(self.times, dtype=np.float64)
+
+    def replay(self, target, sx=1.0, sy=1.0):
+        # target needs draw_line(p1, p2, color, thickness) and erase(center, radius)
+        pts = np.asarray(self.points, dtype=np.float32).reshape(-1, 2) * (sx, sy)
+        pts = np.rint(pts).astype(np.int32).tolist()
+        if self.kind == DRAW:
+            thickness = max(int(round(self.width * sx)), 1)
+            for p1, p2 in zip(pts[:1] + pts[:-1], pts):
+                target.draw_line(tuple(p1), tuple(p2), self.color, thickness)
+        else:
+            radius = max(int(round(self.width / 2 * sx)), 1)
+            for p in pts:
+                target.erase(tuple(p), radius)
+
+
+class StrokeModel:
+    def __init__(self, width=0, height=0):
+        self.width, self.height = width, height  # canvas size the points refer to
+        self.strokes = []
+        self.redo_stack = []
+        self.current = None
+
+    def begin(self, kind, color=(0, 0, 0), width=5):
+        self.end()
+        self.current = Stroke(kind, color, width)
+        self.strokes.append(self.current)
+        self.redo_stack = []
+
+    def add_point(self, x, y, t=0.0):
+        if self.current is not None:
+            self.current.add_point(x, y, t)
+
+    def end(self):
+        if self.current is not None:
+            self.current.finish()
+            self.current = None
+
+    def undo(self):
+        self.end()
+        if not self.strokes:
+            return False
+        self.redo_stack.append(self.strokes.pop())
+        return True
+
+    def redo(self):
+        self.end()
+        if not self.redo_stack:
+            return False
+        self.strokes.append(self.redo_stack.pop())
+        return True
+
+    def clear(self):
+        self.strokes = []
+        self.redo_stack = []
+        self.current = None
+
+    def memory_bytes(self):
+        return sum(np.asarray(s.points).nbytes + np.asarray(s.times).nbytes for s in self.strokes)
+
+    def replay(self, target, width=None, height=None):
+        sx = (width or self.width) / self.width if self.width else 1.0
+        sy = (height or self.height) / self.height if self.height else 1.0
+        for stroke in self.strokes:
+            stroke.replay(target, sx, sy)
+
+    def rasterize(self, width=None, height=None):
+        raster = _Raster(width or self.width, height or self.height)
+        self.replay(raster, raster.width, raster.height)
+        return raster.image
+
+    def snapshot(self):
+        # Finished strokes are never modified again, only the open one is copied
+        copy = StrokeModel(self.width, self.height)
+        for stroke in self.strokes:
+            if stroke is self.current:
+                stroke = _frozen_copy(stroke)
+            copy.strokes.append(stroke)
+        return copy
+
+    def save(self, path):
+        strokes = self.strokes
+        points = [np.asarray(s.points, dtype=np.int16).reshape(-1, 2) for s in strokes]
+        times = [np.asarray(s.times, dtype=np.float64) for s in strokes]
+        t0 = min((t[0] for t in times if len(t)), default=0.0)
+        header = {"version": 1, "width": self.width, "height": self.height}
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                kinds=np.array([s.kind for s in strokes], dtype=np.uint8),
+                colors=np.array([s.color for s in strokes], dtype=np.uint8).reshape(-1, 3),
+                widths=np.array([s.width for s in strokes], dtype=np.uint8),
+                lengths=np.array([len(p) for p in points], dtype=np.uint32),
+                points=np.concatenate(points) if points else np.zeros((0, 2), np.int16),
+                times=(np.concatenate(times) - t0).astype(np.float32) if times else np.zeros(0, np.float32),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode())
+            model = cls(header["width"], header["height"])
+            offsets = np.concatenate([[0], np.cumsum(data["lengths"])]).astype(np.int64)
+            for i, kind in enumerate(data["kinds"]):
+                stroke = Stroke(int(kind), data["colors"][i], data["widths"][i])
+                stroke.points = data["points"][offsets[i]:offsets[i + 1]]
+                stroke.times = data["times"][offsets[i]:offsets[i + 1]].astype(np.float64)
+                model.strokes.append(stroke)
+        return model
+
+
+def _frozen_copy(stroke):
+    copy = Stroke(stroke.kind, stroke.color, stroke.width)
+    copy.points, copy.times = list(stroke.points), list(stroke.times)
+    copy.finish()
+    return copy
+
+
+class _Raster:
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.image = np.zeros((height, width, 3), dtype=np.uint8)
+
+    def draw_line(self, p1, p2, color, thickness):
+        cv2.line(self.image, p1, p2, color, thickness)
+
+    def erase(self, center, radius):
+        cv2.circle(self.image, center, radius, (0, 0, 0), -1)
+
+
+class DrawingWriter:
+    # Saves drawings on a background thread so requests return at once
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, path, model):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.jobs.put((path, model))
+
+    def _run(self):
+        while True:
+            path, model = self.jobs.get()
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                model.save(path)
+            except OSError as e:
+                print(f"Could not save drawing {path}: {e}")
+            finally:
+                self.jobs.task_done()
@@ -0,0 +1,54 @@
+# Per-frame allocation checks for the feature loops that run headless.
+# Frame-sized work is meant to go through the feature's buffers, so in steady
+# state a loop should only allocate small Python objects. Features whose
+# backend is not installed (MediaPipe, the Haar cascades) are skipped.
+#
+#   python -m unittest test_allocation
+
+import unittest
+
+import benchmark
+
+# KB a loop may allocate per frame, far below one 640x480 gray frame (300 KB)
+FRAME_LOOP_KB = 16
+# Sparse flow allocates per tracked point (LK output, the kept points and the
+# arrow geometry), up to max_corners points whatever the frame size
+SPARSE_FLOW_KB = 64
+
+CASES = {
+    "flow_dis": FRAME_LOOP_KB,
+    "filter_blur": FRAME_LOOP_KB,
+    "filter_vintage": FRAME_LOOP_KB,
+    "filter_edges": FRAME_LOOP_KB,
+    "face": FRAME_LOOP_KB,
+    "mouse": FRAME_LOOP_KB,
+    "volume": FRAME_LOOP_KB,
+    "flow": SPARSE_FLOW_KB,
+}
+
+
+class AllocationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        benchmark.install_headless_stubs()
+        cls.frames = {size: benchmark.load_frames(f"synthetic:{size}", 40) for size in ("640x480", "1280x720")}
+
+    def measure(self, name, size="640x480"):
+        try:
+            result = benchmark.run_case(benchmark.CASES[name], self.frames[size],
+                                        memory_frames=30, encode=False)
+        except RuntimeError as e:
+            self.skipTest(f"{name}: {e}")
+        return result["alloc_kb_per_frame"]
+
+    def test_steady_state(self):
+        for name, limit in CASES.items():
+            with self.subTest(name):
+                self.assertLess(self.measure(name), limit)
+
+    def test_sparse_flow_does_not_scale_with_frame_size(self):
+        self.assertLess(self.measure("flow", "1280x720"), SPARSE_FLOW_KB)
+
+
+if __name__ == "__main__":
+    unittest.main()